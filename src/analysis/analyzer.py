@@ -26,7 +26,13 @@ class Analyzer:
                 descriptor_compressed_size REAL,
                 extraction_time REAL,
                 matches_count REAL,
-                matching_time REAL);
+                matching_time REAL,
+                scale REAL,
+                compaction TEXT,
+                selection TEXT,
+                selection_time REAL,
+                matcher TEXT,
+                tiling TEXT);
             CREATE TABLE IF NOT EXISTS reconstruction (
                 id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
                 sequence TEXT,
@@ -34,7 +40,14 @@ class Analyzer:
                 feature_type TEXT,
                 points INTEGER,
                 observations INTEGER,
-                error REAL);
+                error REAL,
+                scale REAL,
+                compaction TEXT,
+                selection TEXT,
+                matcher TEXT,
+                tiling TEXT,
+                pairs TEXT,
+                verification TEXT);
             CREATE TABLE IF NOT EXISTS ranking (
                 id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
                 sequence TEXT,
@@ -46,6 +59,38 @@ class Analyzer:
                 points2 INTEGER,
                 error1 REAL,
                 error2 REAL);
+            CREATE VIEW IF NOT EXISTS compaction_q AS
+                SELECT C.sequence, C.detector_type, C.feature_type, C.scale,
+                    C.compaction, CR.pairs, CR.verification,
+                    C.descriptor_size / R.descriptor_size AS size_ratio,
+                    C.descriptor_compressed_size /
+                        R.descriptor_compressed_size AS compressed_size_ratio,
+                    C.matching_time / R.matching_time AS matching_time_ratio,
+                    CR.points - RR.points AS points_change,
+                    CR.error - RR.error AS error_change
+                FROM correspondence AS C
+                    INNER JOIN
+                correspondence AS R ON C.sequence = R.sequence
+                    AND C.detector_type = R.detector_type
+                    AND C.feature_type = R.feature_type AND C.scale = R.scale
+                    AND C.selection = R.selection AND C.matcher = R.matcher
+                    AND C.tiling = R.tiling
+                    AND R.compaction = ''
+                    LEFT JOIN
+                reconstruction AS CR ON C.sequence = CR.sequence
+                    AND C.detector_type = CR.detector_type
+                    AND C.feature_type = CR.feature_type AND C.scale = CR.scale
+                    AND C.selection = CR.selection AND C.matcher = CR.matcher
+                    AND C.tiling = CR.tiling AND C.compaction = CR.compaction
+                    LEFT JOIN
+                reconstruction AS RR ON R.sequence = RR.sequence
+                    AND R.detector_type = RR.detector_type
+                    AND R.feature_type = RR.feature_type AND R.scale = RR.scale
+                    AND R.selection = RR.selection AND R.matcher = RR.matcher
+                    AND R.tiling = RR.tiling AND RR.compaction = ''
+                    AND CR.pairs = RR.pairs
+                    AND CR.verification = RR.verification
+                WHERE C.compaction != '';
             CREATE VIEW IF NOT EXISTS ranking_q AS
                 SELECT sequence, detector_type1 AS detector_type, feature_type1 AS feature_type,
                     SUM(CASE WHEN error1 < error2 THEN 1 ELSE 0 END) AS score
@@ -114,8 +159,12 @@ class Analyzer:
     def analyze(self):
         sequences = {}
         for idx, point_cloud_path in enumerate(sorted(glob.glob(os.path.join(self.point_cloud_path, '*')))):
-            sequence, detector_type, feature_type = os.path.split(point_cloud_path)[
-                1].split('_')
+            sequence, detector_type, feature_type, *scale = os.path.split(
+                point_cloud_path)[1].split('_')
+            # Downscaled, compacted and spatially selected runs are reported
+            # in correspondence and reconstruction only.
+            if scale:
+                continue
             if sequence not in sequences:
                 sequences[sequence] = {}
             point_cloud_path = os.path.join(point_cloud_path, '0')
@@ -158,26 +207,41 @@ class Analyzer:
         cur.execute('''
             INSERT INTO local.correspondence(sequence, detector_type, feature_type,
                 feature_count, descriptor_size, descriptor_compressed_size, extraction_time,
-                matches_count, matching_time)
+                matches_count, matching_time, scale, compaction, selection,
+                selection_time, matcher, tiling)
             SELECT sequence.name, detector_type.name, feature_type.name,
                 F.feature_count, F.descriptor_size, F.descriptor_compressed_size, F.extraction_time,
-                M.matches_count, M.matching_time
+                M.matches_count, M.matching_time, F.scale, F.compaction,
+                F.selection, F.selection_time, M.matcher, F.tiling
             FROM
                 (
                 SELECT image.sequence, image_feature.detector_type, image_feature.feature_type,
+                    image_feature.scale, image_feature.compaction,
+                    image_feature.selection,
+                    image_feature.tiling,
                     sum(image_feature.count) AS feature_count,
                     sum(image_feature.size) AS descriptor_size,
-                    sum(length(image_feature.data)) AS descriptor_compressed_size,
-                    sum(image_feature.time) AS extraction_time
+                    sum(coalesce(image_feature.data_size,
+                                 length(image_feature.data)))
+                        AS descriptor_compressed_size,
+                    sum(image_feature.time) AS extraction_time,
+                    sum(image_feature.selection_time) AS selection_time
                 FROM
                     image_feature
                         INNER JOIN
                     image on image_feature.image = image.id
-                GROUP BY image.sequence, image_feature.detector_type, image_feature.feature_type
+                GROUP BY image.sequence, image_feature.detector_type,
+                    image_feature.feature_type,
+                    image_feature.scale, image_feature.compaction,
+                    image_feature.selection,
+                    image_feature.tiling
                 ) AS F
                     INNER JOIN
                 (
                 SELECT image.sequence, image_feature.detector_type, image_feature.feature_type,
+                    image_feature.scale, image_feature.compaction,
+                    image_feature.selection,
+                    image_feature.tiling, feature_match.matcher,
                     sum(feature_match.count) AS matches_count,
                     sum(feature_match.time) AS matching_time
                 FROM
@@ -186,8 +250,17 @@ class Analyzer:
                     image_feature on feature_match.feature1 = image_feature.id
                         INNER JOIN
                     image on image_feature.image = image.id
-                GROUP BY image.sequence, image_feature.detector_type, image_feature.feature_type
-                ) AS M on F.sequence = M.sequence AND F.feature_type = M.feature_type
+                GROUP BY image.sequence, image_feature.detector_type,
+                    image_feature.feature_type,
+                    image_feature.scale, image_feature.compaction,
+                    image_feature.selection,
+                    image_feature.tiling, feature_match.matcher
+                ) AS M on F.sequence = M.sequence
+                    AND F.detector_type = M.detector_type
+                    AND F.feature_type = M.feature_type AND F.scale = M.scale
+                    AND F.compaction = M.compaction
+                    AND F.selection = M.selection
+                    AND F.tiling = M.tiling
                     INNER JOIN
                 sequence on M.sequence = sequence.id
                     INNER JOIN
@@ -197,8 +270,12 @@ class Analyzer:
             ''')
         cur.execute('''
             INSERT INTO local.reconstruction(sequence, detector_type, feature_type,
-                points, observations, error)
-            SELECT sequence.name, detector_type.name, feature_type.name, points, observations, error
+                points, observations, error, scale, compaction, selection,
+                matcher, tiling, pairs, verification)
+            SELECT sequence.name, detector_type.name, feature_type.name,
+                points, observations, error, analysis.scale,
+                analysis.compaction, analysis.selection, analysis.matcher,
+                analysis.tiling, analysis.pairs, analysis.verification
             FROM
                 analysis
                     INNER JOIN
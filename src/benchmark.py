@@ -0,0 +1,241 @@
+import os
+import cv2
+import time
+import sqlite3
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .features import extractor as ext
+from .features import pairs as pr
+from .features.matcher import Matcher
+from .data import codec as cd
+from .data.database import Database, SharedDatabase
+
+
+def benchmarkExtractor(detector_types, feature_types, repeat=10):
+    rows = []
+    for detector_type in detector_types:
+        for feature_type in feature_types:
+            # What Extractor.__init__ used to pay: every registered algorithm.
+            tic = time.time()
+            for name in ext.FEATURE_ALGORITHMS:
+                if ext.algorithmFactory(name) is not None:
+                    ext.createAlgorithm(
+                        name, ext.algorithmParams(name, detector_type))
+            eager_time = time.time() - tic
+            ext.clearAlgorithms()
+            tic = time.time()
+            ext.Extractor(detector_type, feature_type)
+            cold_time = time.time() - tic
+            tic = time.time()
+            for _ in range(repeat):
+                ext.Extractor(detector_type, feature_type)
+            warm_time = (time.time() - tic) / repeat
+            logging.info('%s_%s: eager %f, cold %f, warm %f seconds',
+                         detector_type, feature_type,
+                         eager_time, cold_time, warm_time)
+            rows.append((detector_type, feature_type,
+                         eager_time, cold_time, warm_time))
+    return rows
+
+
+def benchmarkRetrieval(experiment, k=10, top=None):
+    # Expects experiment.createViews() to have been run.
+    views = experiment.views
+    tic = time.time()
+    neighbors = experiment.retrieve(k)
+    retrieval_time = time.time() - tic
+    counts = {}
+    tic = time.time()
+    for j, i in pr.exhaustivePairs(len(views)):
+        experiment.makeResident(views[j])
+        experiment.makeResident(views[i])
+        counts[(j, i)] = experiment.matcher.match(views[j], views[i])[1]
+    exhaustive_time = time.time() - tic
+    pairs = pr.retrievalPairs(neighbors)
+    tic = time.time()
+    for j, i in pairs:
+        experiment.makeResident(views[j])
+        experiment.makeResident(views[i])
+        experiment.matcher.match(views[j], views[i])
+    retrieved_time = time.time() - tic
+    # Recall of the pairs with the most matches, as many as were retrieved.
+    top = len(pairs) if top is None else top
+    best = sorted(counts, key=lambda pair: -counts[pair])[:top]
+    recall = len(set(best) & set(pairs)) / max(len(best), 1)
+    logging.info('retrieval top-%d: %d of %d pairs, retrieval %f, '
+                 'matching %f, exhaustive %f seconds, recall %f',
+                 k, len(pairs), len(counts), retrieval_time, retrieved_time,
+                 exhaustive_time, recall)
+    return (len(pairs), len(counts), retrieval_time, retrieved_time,
+            exhaustive_time, recall)
+
+
+def benchmarkMatcher(experiment, backends=('flann',), max_pairs=100):
+    # Expects experiment.createViews() to have been run.
+    views = experiment.views
+    pairs = pr.exhaustivePairs(len(views))[:max_pairs]
+    matchers = {backend: Matcher(experiment.matcher.normType,
+                                 experiment.matcher.crossCheck, backend)
+                for backend in ('bf',) + tuple(backends)}
+    times = dict.fromkeys(matchers, 0)
+    found = dict.fromkeys(matchers, 0)
+    recalled = dict.fromkeys(matchers, 0)
+    for j, i in pairs:
+        experiment.makeResident(views[j])
+        experiment.makeResident(views[i])
+        reference = None
+        for backend, matcher in matchers.items():
+            tic = time.time()
+            matches, _ = matcher.matchDescriptors(views[j].descriptors,
+                                                  views[i].descriptors)
+            times[backend] += time.time() - tic
+            matches = set(zip(matches['queryIdx'].tolist(),
+                              matches['trainIdx'].tolist()))
+            if reference is None:
+                reference = matches
+            found[backend] += len(matches)
+            recalled[backend] += len(matches & reference)
+    rows = []
+    for backend in backends:
+        speedup = times['bf'] / max(times[backend], 1e-12)
+        recall = recalled[backend] / max(found['bf'], 1)
+        logging.info('%s: %d pairs, bf %f, %s %f seconds, speedup %f, '
+                     'recall %f',
+                     backend, len(pairs), times['bf'], backend,
+                     times[backend], speedup, recall)
+        rows.append((backend, len(pairs), times['bf'], times[backend],
+                     found[backend], speedup, recall))
+    return rows
+
+
+def benchmarkEngine(experiment, max_pairs=100):
+    # Expects experiment.createViews() to have been run.
+    views = experiment.views
+    pairs = pr.exhaustivePairs(len(views))[:max_pairs]
+    reference = cv2.BFMatcher(experiment.matcher.normType, True)
+    engine = Matcher(experiment.matcher.normType, True)
+    reference_time = engine_time = 0
+    found = same = 0
+    for j, i in pairs:
+        experiment.makeResident(views[j])
+        experiment.makeResident(views[i])
+        if len(views[j].descriptors) == 0 or len(views[i].descriptors) == 0:
+            continue
+        tic = time.time()
+        expected = sorted(reference.match(views[j].descriptors,
+                                          views[i].descriptors),
+                          key=lambda x: x.distance)[:experiment.max_matches]
+        reference_time += time.time() - tic
+        tic = time.time()
+        matches, _ = engine.matchDescriptors(views[j].descriptors,
+                                             views[i].descriptors,
+                                             experiment.max_matches)
+        engine_time += time.time() - tic
+        found += len(expected)
+        same += len({(match.queryIdx, match.trainIdx) for match in expected} &
+                    set(zip(matches['queryIdx'].tolist(),
+                            matches['trainIdx'].tolist())))
+    logging.info('engine: %d pairs, bf %f, engine %f seconds, speedup %f, '
+                 'agreement %f', len(pairs), reference_time, engine_time,
+                 reference_time / max(engine_time, 1e-12),
+                 same / max(found, 1))
+    return len(pairs), reference_time, engine_time, same / max(found, 1)
+
+
+def benchmarkCodec(database, codecs=None,
+                   tables=('image_feature', 'feature_match'), limit=100):
+    codecs = cd.availableCodecs() if codecs is None else codecs
+    rows = []
+    for table in tables:
+        blobs = database.getBlobs(table, limit)
+        raw_size = sum(len(cd.encode(data, 'raw')) for data in blobs)
+        for codec in codecs:
+            tic = time.time()
+            encoded = [cd.encode(data, codec) for data in blobs]
+            encode_time = time.time() - tic
+            tic = time.time()
+            for blob in encoded:
+                cd.decode(blob, codec)
+            decode_time = time.time() - tic
+            size = sum(len(blob) for blob in encoded)
+            encode_speed = raw_size / 2 ** 20 / max(encode_time, 1e-12)
+            decode_speed = raw_size / 2 ** 20 / max(decode_time, 1e-12)
+            ratio = raw_size / max(size, 1)
+            logging.info('%s %s: %d blobs, %d bytes, encode %f MB/s, '
+                         'decode %f MB/s, ratio %f',
+                         table, codec, len(blobs), size, encode_speed,
+                         decode_speed, ratio)
+            rows.append((table, codec, len(blobs), size, encode_speed,
+                         decode_speed, ratio))
+    return rows
+
+
+def benchmarkDatabase(database_path, workers=(1, 8, 32), tasks=256, chunk=8,
+                      modes=('thread', 'process', 'shared')):
+    # Every task reads two cached features and writes a match between them,
+    # on a copy so the benchmark rows never reach the real database. Thread
+    # and process workers open their own Database for each chunk of tasks,
+    # committing every row, as concurrent experiments would.
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_path:
+        for mode in modes:
+            for count in workers:
+                copy_path = os.path.join(temp_path, f'{mode}{count}.sqlite')
+                source = sqlite3.connect(database_path)
+                target = sqlite3.connect(copy_path)
+                source.backup(target)
+                source.close()
+                target.close()
+                database = SharedDatabase(copy_path) if mode == 'shared' else \
+                    Database(copy_path)
+                feature_ids = database.getRowIds('image_feature', tasks)
+                if len(feature_ids) < 2:
+                    logging.error(
+                        'Invalid database, needs at least two features!')
+                    raise Exception(
+                        'Invalid database, needs at least two features!')
+                chunks = [range(start, min(start + chunk, tasks))
+                          for start in range(0, tasks, chunk)]
+                tic = time.time()
+                if mode == 'process':
+                    with ProcessPoolExecutor(count) as executor:
+                        errors = sum(executor.map(
+                            _databaseTasks, [copy_path] * len(chunks),
+                            [feature_ids] * len(chunks), chunks))
+                else:
+                    shared = database if mode == 'shared' else None
+                    with ThreadPoolExecutor(count) as executor:
+                        errors = sum(executor.map(
+                            _databaseTasks, [copy_path] * len(chunks),
+                            [feature_ids] * len(chunks), chunks,
+                            [shared] * len(chunks)))
+                database.commit()
+                elapsed = time.time() - tic
+                database.close()
+                logging.info('%s %d workers: %d tasks, %f seconds, '
+                             '%f tasks per second, %d errors',
+                             mode, count, tasks, elapsed,
+                             tasks / max(elapsed, 1e-12), errors)
+                rows.append((mode, count, tasks, elapsed,
+                             tasks / max(elapsed, 1e-12), errors))
+    return rows
+
+
+def _databaseTasks(database_path, feature_ids, indices, database=None):
+    connection = Database(database_path, autocommit=True) if database is None \
+        else database
+    errors = 0
+    for idx in indices:
+        feature1 = feature_ids[idx % len(feature_ids)]
+        feature2 = feature_ids[(idx + 1) % len(feature_ids)]
+        try:
+            matches = connection.getFeatureById(feature1)[1][:10]
+            connection.getFeatureById(feature2)
+            connection.putMatch(feature1, feature2, len(matches), 0, matches,
+                                f'benchmark{idx}')
+        except sqlite3.OperationalError:
+            errors += 1
+    if database is None:
+        connection.close()
+    return errors
@@ -0,0 +1,76 @@
+import re
+import zlib
+import pickle
+import logging
+import compress_pickle
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Rows written before codecs were recorded use compress_pickle with LZMA.
+DEFAULT_CODEC = 'lzma'
+
+# Levels each codec accepts, codecs missing here take no level.
+CODEC_LEVELS = {'zlib': range(0, 10), 'zstd': range(1, 23)}
+
+
+def availableCodecs():
+    codecs = ['lzma', 'raw', 'zlib1', 'zlib6', 'zlib9']
+    if lz4 is not None:
+        codecs.append('lz4')
+    if zstandard is not None:
+        codecs += ['zstd1', 'zstd3', 'zstd9']
+    return codecs
+
+
+def parseCodec(codec):
+    match = re.fullmatch(r'(lzma|raw|zlib|lz4|zstd)(0|[1-9]\d*)?', codec)
+    if match is None:
+        logging.error(f'Invalid codec <{codec}>!')
+        raise Exception(f'Invalid codec <{codec}>!')
+    name, level = match.groups()
+    if level and int(level) not in CODEC_LEVELS.get(name, []):
+        logging.error(f'Invalid level of codec <{codec}>!')
+        raise Exception(f'Invalid level of codec <{codec}>!')
+    if (name == 'lz4' and lz4 is None) or \
+            (name == 'zstd' and zstandard is None):
+        logging.error(f'Codec <{codec}> is not installed!')
+        raise Exception(f'Codec <{codec}> is not installed!')
+    return name, int(level) if level else None
+
+
+def encode(data, codec=DEFAULT_CODEC):
+    name, level = parseCodec(codec)
+    if name == 'lzma':
+        return compress_pickle.dumps(data, compression='lzma')
+    # Protocol 5 writes NumPy arrays as their raw buffers.
+    buffer = pickle.dumps(data, protocol=5)
+    if name == 'zlib':
+        return zlib.compress(buffer, 6 if level is None else level)
+    elif name == 'lz4':
+        return lz4.frame.compress(buffer)
+    elif name == 'zstd':
+        compressor = zstandard.ZstdCompressor(3 if level is None else level)
+        return compressor.compress(buffer)
+    return buffer
+
+
+def decode(blob, codec=DEFAULT_CODEC):
+    name, _ = parseCodec(codec or DEFAULT_CODEC)
+    if name == 'lzma':
+        return compress_pickle.loads(blob, compression='lzma')
+    if name == 'zlib':
+        blob = zlib.decompress(blob)
+    elif name == 'lz4':
+        blob = lz4.frame.decompress(blob)
+    elif name == 'zstd':
+        blob = zstandard.ZstdDecompressor().decompress(blob)
+    return pickle.loads(blob)
@@ -1,12 +1,73 @@
+import os
+import time
+import queue
 import sqlite3
-import compress_pickle as pickle
+import logging
+import threading
+from urllib.request import pathname2url
+from concurrent.futures import Future
+from ..features.keypoint import toKeypointArray
+from ..features.match import toMatchArray
+from .codec import DEFAULT_CODEC, parseCodec, encode, decode
+from .store import STORE_CODEC, ArrayStore
+
+
+# Cache lookup keys, each one backed by a unique index.
+UNIQUE_KEYS = {
+    'image_feature': ('image', 'detector_type', 'feature_type', 'scale',
+                      'compaction', 'selection', 'tiling'),
+    'image_keypoint': ('image', 'detector_type', 'params', 'scale'),
+    'feature_match': ('feature1', 'feature2', 'matcher'),
+    'match_geometry': ('match', 'params'),
+    'descriptor_compaction': ('sequence', 'detector_type', 'feature_type',
+                              'scale', 'compaction'),
+    'visual_vocabulary': ('feature_type', 'compaction', 'words'),
+    'retrieval_index': ('sequence', 'detector_type', 'feature_type', 'scale',
+                        'compaction', 'selection', 'words', 'tiling'),
+}
+
+
+# Images of a sequence with features of one run, for joins on image_feature.
+SEQUENCE_FEATURES = 'INNER JOIN image ON image_feature.image = image.id ' \
+    'WHERE image.sequence = ? AND image_feature.detector_type = ? ' \
+    'AND image_feature.feature_type = ? AND image_feature.scale = ? ' \
+    'AND image_feature.compaction = ? AND image_feature.selection = ? ' \
+    'AND image_feature.tiling = ?'
 
 
 class Database:
-    def __init__(self, database_path):
+    def __init__(self, database_path, codec=DEFAULT_CODEC, store_path=None,
+                 commit_rows=1000, commit_seconds=60, wal=True, readonly=False,
+                 timeout=60, autocommit=False):
+        parseCodec(codec)
         self.database_path = database_path
-        self.con = sqlite3.connect(database_path)
+        self.codec = codec
+        self.store_path = store_path
+        self.store = ArrayStore(store_path) if store_path else None
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.pending_rows = 0
+        self.write_time = None
+        self.batches = {}
+        self.wal = wal
+        self.readonly = readonly
+        self.autocommit = autocommit
+        if readonly:
+            self.con = sqlite3.connect(
+                f'file:{pathname2url(os.path.abspath(database_path))}?mode=ro',
+                timeout=timeout, uri=True)
+        else:
+            self.con = sqlite3.connect(database_path, timeout=timeout)
         self.cur = self.con.cursor()
+        self.cur.execute('PRAGMA cache_size = -65536')
+        self.cur.execute('PRAGMA temp_store = MEMORY')
+        if readonly:
+            return
+        if wal:
+            # Readers never block the writer, and WAL stays consistent with
+            # commits that only sync at checkpoints.
+            self.cur.execute('PRAGMA journal_mode = WAL')
+            self.cur.execute('PRAGMA synchronous = NORMAL')
         self.cur.executescript('''
         CREATE TABLE IF NOT EXISTS sequence (
             id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
@@ -28,9 +89,25 @@ class Database:
             size REAL,
             time REAL,
             data BLOB,
+            detection_time REAL,
+            description_time REAL,
+            scale REAL NOT NULL DEFAULT 1,
+            compaction TEXT NOT NULL DEFAULT '',
+            compaction_time REAL,
             FOREIGN KEY(image) REFERENCES image(id) ON DELETE CASCADE,
             FOREIGN KEY(detector_type) REFERENCES feature_type(id) ON DELETE CASCADE,
             FOREIGN KEY(feature_type) REFERENCES feature_type(id) ON DELETE CASCADE);
+        CREATE TABLE IF NOT EXISTS image_keypoint (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            image INTEGER NOT NULL,
+            detector_type INTEGER NOT NULL,
+            params TEXT NOT NULL,
+            count INTEGER,
+            time REAL,
+            data BLOB,
+            scale REAL NOT NULL DEFAULT 1,
+            FOREIGN KEY(image) REFERENCES image(id) ON DELETE CASCADE,
+            FOREIGN KEY(detector_type) REFERENCES feature_type(id) ON DELETE CASCADE);
         CREATE TABLE IF NOT EXISTS feature_match (
             id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
             feature1 INTEGER NOT NULL,
@@ -40,6 +117,15 @@ class Database:
             data BLOB,
             FOREIGN KEY(feature1) REFERENCES image_feature(id) ON DELETE CASCADE,
             FOREIGN KEY(feature2) REFERENCES image_feature(id) ON DELETE CASCADE);
+        CREATE TABLE IF NOT EXISTS match_geometry (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            match INTEGER NOT NULL,
+            params TEXT,
+            config INTEGER,
+            count INTEGER,
+            time REAL,
+            data BLOB,
+            FOREIGN KEY(match) REFERENCES feature_match(id) ON DELETE CASCADE);
         CREATE TABLE IF NOT EXISTS analysis (
             id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
             sequence INTEGER NOT NULL,
@@ -48,25 +134,204 @@ class Database:
             points INTEGER,
             observations INTEGER,
             error REAL,
+            scale REAL NOT NULL DEFAULT 1,
+            compaction TEXT NOT NULL DEFAULT '',
+            FOREIGN KEY(sequence) REFERENCES sequence(id) ON DELETE CASCADE,
+            FOREIGN KEY(detector_type) REFERENCES feature_type(id) ON DELETE CASCADE,
+            FOREIGN KEY(feature_type) REFERENCES feature_type(id) ON DELETE CASCADE);
+        CREATE TABLE IF NOT EXISTS descriptor_compaction (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            sequence INTEGER NOT NULL,
+            detector_type INTEGER NOT NULL,
+            feature_type INTEGER NOT NULL,
+            scale REAL NOT NULL DEFAULT 1,
+            compaction TEXT NOT NULL,
+            data BLOB,
+            FOREIGN KEY(sequence) REFERENCES sequence(id) ON DELETE CASCADE,
+            FOREIGN KEY(detector_type) REFERENCES feature_type(id) ON DELETE CASCADE,
+            FOREIGN KEY(feature_type) REFERENCES feature_type(id) ON DELETE CASCADE);
+        CREATE TABLE IF NOT EXISTS visual_vocabulary (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            feature_type INTEGER NOT NULL,
+            compaction TEXT NOT NULL,
+            words INTEGER NOT NULL,
+            time REAL,
+            data BLOB,
+            FOREIGN KEY(feature_type) REFERENCES feature_type(id) ON DELETE CASCADE);
+        CREATE TABLE IF NOT EXISTS retrieval_index (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            sequence INTEGER NOT NULL,
+            detector_type INTEGER NOT NULL,
+            feature_type INTEGER NOT NULL,
+            scale REAL NOT NULL DEFAULT 1,
+            compaction TEXT NOT NULL,
+            selection TEXT NOT NULL,
+            words INTEGER NOT NULL,
+            time REAL,
+            data BLOB,
             FOREIGN KEY(sequence) REFERENCES sequence(id) ON DELETE CASCADE,
             FOREIGN KEY(detector_type) REFERENCES feature_type(id) ON DELETE CASCADE,
             FOREIGN KEY(feature_type) REFERENCES feature_type(id) ON DELETE CASCADE);
         ''')
+        self.addColumns('image_feature', {
+            'detection_time': 'REAL',
+            'description_time': 'REAL',
+            'scale': 'REAL NOT NULL DEFAULT 1',
+            'compaction': "TEXT NOT NULL DEFAULT ''",
+            'compaction_time': 'REAL',
+            'selection': "TEXT NOT NULL DEFAULT ''",
+            'selection_time': 'REAL',
+            'tiling': "TEXT NOT NULL DEFAULT ''",
+            'data_size': 'INTEGER'})
+        self.addColumns('image_keypoint', {'scale': 'REAL NOT NULL DEFAULT 1'})
+        self.addColumns('feature_match', {
+            'matcher': "TEXT NOT NULL DEFAULT ''",
+            'data_size': 'INTEGER'})
+        self.addColumns('analysis', {
+            'scale': 'REAL NOT NULL DEFAULT 1',
+            'compaction': "TEXT NOT NULL DEFAULT ''",
+            'selection': "TEXT NOT NULL DEFAULT ''",
+            'matcher': "TEXT NOT NULL DEFAULT ''",
+            'tiling': "TEXT NOT NULL DEFAULT ''",
+            'pairs': "TEXT NOT NULL DEFAULT ''",
+            'verification': "TEXT NOT NULL DEFAULT 'colmap'"})
+        self.addColumns('retrieval_index', {
+            'tiling': "TEXT NOT NULL DEFAULT ''"})
+        for table, columns in UNIQUE_KEYS.items():
+            # Rows record the codec of their blob, so databases can mix codecs.
+            self.addColumns(table, {
+                'codec': f"TEXT NOT NULL DEFAULT '{DEFAULT_CODEC}'"})
+            self.addUniqueIndex(table, columns)
+
+    def addColumns(self, table, columns):
+        self.cur.execute(f'PRAGMA table_info({table})')
+        existing = [row[1] for row in self.cur.fetchall()]
+        for name, column_type in columns.items():
+            if name not in existing:
+                self.cur.execute(
+                    f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+    def addUniqueIndex(self, table, columns):
+        self.cur.execute(f'PRAGMA index_info({table}_key)')
+        existing = [row[2] for row in self.cur.fetchall()]
+        if existing == list(columns):
+            return
+        if existing:
+            # The key gained columns, rebuild its index.
+            self.cur.execute(f'DROP INDEX {table}_key')
+        # Lookups always returned the first of duplicated rows, keep that one.
+        columns = ', '.join(columns)
+        self.cur.execute(f'DELETE FROM {table} WHERE id NOT IN '
+                         f'(SELECT MIN(id) FROM {table} GROUP BY {columns})')
+        self.cur.execute(
+            f'CREATE UNIQUE INDEX {table}_key ON {table}({columns})')
+        self.con.commit()
+
+    def upsertQuery(self, table, columns):
+        keys = UNIQUE_KEYS[table]
+        updates = ', '.join(f'{column} = excluded.{column}'
+                            for column in columns if column not in keys)
+        return f'INSERT INTO {table}({", ".join(columns)}) ' \
+            f'VALUES ({", ".join("?" * len(columns))}) ' \
+            f'ON CONFLICT({", ".join(keys)}) DO UPDATE SET {updates}'
+
+    def upsert(self, table, values):
+        keys = UNIQUE_KEYS[table]
+        self.cur.execute(self.upsertQuery(table, list(values)),
+                         tuple(values.values()))
+        where = ' AND '.join(f'{key} = ?' for key in keys)
+        self.cur.execute(f'SELECT id FROM {table} WHERE {where}',
+                         tuple(values[key] for key in keys))
+        row_id = self.cur.fetchone()[0]
+        self.written()
+        return row_id
+
+    def queue(self, table, values):
+        # Rows nobody needs the id of are written with executemany on flush,
+        # until then lookups find them by key in the batch.
+        key = tuple(values[column] for column in UNIQUE_KEYS[table])
+        self.batches.setdefault(table, {})[key] = values
+        self.checkpoint()
+
+    def queued(self, table, *key):
+        return self.batches.get(table, {}).get(key)
+
+    def flush(self):
+        for table, rows in self.batches.items():
+            rows = list(rows.values())
+            self.cur.executemany(self.upsertQuery(table, list(rows[0])),
+                                 [tuple(values.values()) for values in rows])
+        self.batches = {}
+
+    def written(self):
+        # Processes sharing the file commit every row they need the id of, so
+        # they only ever wait for a single statement of one another. In WAL
+        # mode these commits do not sync, queued rows still go out in batches.
+        if self.autocommit:
+            self.con.commit()
+        else:
+            self.checkpoint()
+
+    def checkpoint(self, rows=1):
+        # Pending rows are committed by count or by the age of the oldest.
+        if self.write_time is None:
+            self.write_time = time.time()
+        self.pending_rows += rows
+        if (self.commit_rows is not None and
+                self.pending_rows >= self.commit_rows) or \
+                (self.commit_seconds is not None and
+                 time.time() - self.write_time >= self.commit_seconds):
+            self.commit()
 
     def commit(self):
         if self.con:
+            self.flush()
             self.con.commit()
+        self.pending_rows = 0
+        self.write_time = None
 
     def close(self):
         if self.con:
-            self.con.commit()
+            self.commit()
             self.con.close()
 
+    def reader(self):
+        return Database(self.database_path, self.codec, self.store_path,
+                        readonly=True)
+
     def to_blob(self, data):
-        return sqlite3.Binary(pickle.dumps(data, compression='lzma'))
+        return sqlite3.Binary(encode(data, self.codec))
+
+    def from_blob(self, blob, codec=DEFAULT_CODEC):
+        if codec == STORE_CODEC:
+            if self.store is None:
+                logging.error(f'Invalid array store for codec <{codec}>!')
+                raise Exception(f'Invalid array store for codec <{codec}>!')
+            return self.store.decode(blob)
+        return decode(blob, codec)
+
+    def blobColumns(self, data, external=False):
+        # Feature and match arrays go to the array store when there is one,
+        # data_size keeps the bytes they take there.
+        if external and self.store is not None:
+            blob = self.store.encode(data)
+            return {'data': sqlite3.Binary(blob), 'codec': STORE_CODEC,
+                    'data_size': self.store.size(blob)}
+        blob = self.to_blob(data)
+        if external:
+            return {'data': blob, 'codec': self.codec, 'data_size': len(blob)}
+        return {'data': blob, 'codec': self.codec}
+
+    def getRowIds(self, table, limit=100):
+        self.cur.execute(f'SELECT id from {table} ORDER BY id LIMIT ?',
+                         (limit,))
+        return [row[0] for row in self.cur.fetchall()]
 
-    def from_blob(self, blob):
-        return pickle.loads(blob, compression='lzma')
+    def getBlobs(self, table, limit=100):
+        self.cur.execute(
+            f'SELECT data, codec from {table} ORDER BY id LIMIT ?', (limit,))
+        return [self.from_blob(data, codec)
+                for data, codec in self.cur.fetchall()]
 
     def getSequenceId(self, name):
         self.cur.execute('SELECT id from sequence WHERE name = ?', (name,))
@@ -75,7 +340,9 @@ class Database:
             return row[0]
         else:
             self.cur.execute('INSERT INTO sequence(name) VALUES (?)', (name,))
-            return self.cur.lastrowid
+            row_id = self.cur.lastrowid
+            self.written()
+            return row_id
 
     def getFeatureTypeId(self, name):
         self.cur.execute('SELECT id from feature_type WHERE name = ?', (name,))
@@ -85,7 +352,9 @@ class Database:
         else:
             self.cur.execute(
                 'INSERT INTO feature_type(name) VALUES (?)', (name,))
-            return self.cur.lastrowid
+            row_id = self.cur.lastrowid
+            self.written()
+            return row_id
 
     def getImageId(self, name, sequence):
         self.cur.execute(
@@ -96,32 +365,355 @@ class Database:
         else:
             self.cur.execute(
                 'INSERT INTO image(name, sequence) VALUES (?, ?)', (name, sequence))
-            return self.cur.lastrowid
+            row_id = self.cur.lastrowid
+            self.written()
+            return row_id
+
+    def getFeature(self, image, detector_type, feature_type, scale=1,
+                   compaction='', selection='', tiling=''):
+        self.cur.execute(
+            'SELECT id, data, codec from image_feature WHERE image = ? '
+            'AND detector_type = ? AND feature_type = ? AND scale = ? '
+            'AND compaction = ? AND selection = ? AND tiling = ?',
+            (image, detector_type, feature_type, scale, compaction, selection,
+             tiling))
+        row = self.cur.fetchone()
+        if row:
+            keypoints, descriptors = self.from_blob(row[1], row[2])
+            return row[0], (toKeypointArray(keypoints), descriptors)
+        else:
+            return None
 
-    def getFeature(self, image, detector_type, feature_type):
-        self.cur.execute('SELECT id, data from image_feature WHERE image = ? AND detector_type = ? AND feature_type = ?',
-                         (image, detector_type, feature_type))
+    def getFeatureById(self, feature_id):
+        self.cur.execute('SELECT data, codec from image_feature WHERE id = ?',
+                         (feature_id,))
         row = self.cur.fetchone()
         if row:
-            return row[0], self.from_blob(row[1])
+            keypoints, descriptors = self.from_blob(row[0], row[1])
+            return toKeypointArray(keypoints), descriptors
         else:
             return None
 
-    def putFeature(self, image, detector_type, feature_type, count, size, time, data):
-        self.cur.execute('INSERT INTO image_feature(image, detector_type, feature_type, count, size, time, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                         (image, detector_type, feature_type, count, size, time, self.to_blob(data)))
-        return self.cur.lastrowid
+    def getFeatureInfo(self, feature_id):
+        self.cur.execute(
+            'SELECT count, time, detection_time, description_time, '
+            'selection_time from image_feature WHERE id = ?',
+            (feature_id,))
+        return self.cur.fetchone()
+
+    def putFeature(self, image, detector_type, feature_type, count, size, time,
+                   data, detection_time=None, description_time=None, scale=1,
+                   compaction='', compaction_time=None, selection='',
+                   selection_time=None, tiling=''):
+        return self.upsert('image_feature', {
+            'image': image, 'detector_type': detector_type,
+            'feature_type': feature_type, 'count': count, 'size': size,
+            'time': time, **self.blobColumns(data, external=True),
+            'detection_time': detection_time,
+            'description_time': description_time, 'scale': scale,
+            'compaction': compaction, 'compaction_time': compaction_time,
+            'selection': selection, 'selection_time': selection_time,
+            'tiling': tiling})
 
-    def getMatch(self, feature1, feature2):
+    def getCompaction(self, sequence, detector_type, feature_type, scale,
+                      compaction):
         self.cur.execute(
-            'SELECT id, data from feature_match WHERE feature1 = ? AND feature2 = ?', (feature1, feature2))
+            'SELECT data, codec from descriptor_compaction '
+            'WHERE sequence = ? AND detector_type = ? AND feature_type = ? '
+            'AND scale = ? AND compaction = ?',
+            (sequence, detector_type, feature_type, scale, compaction))
         row = self.cur.fetchone()
         if row:
-            return row[0], self.from_blob(row[1])
+            return self.from_blob(row[0], row[1])
         else:
             return None
 
-    def putMatch(self, feature1, feature2, count, time, data):
-        self.cur.execute('INSERT INTO feature_match(feature1, feature2, count, time, data) VALUES (?, ?, ?, ?, ?)',
-                         (feature1, feature2, count, time, self.to_blob(data)))
-        return self.cur.lastrowid
+    def putCompaction(self, sequence, detector_type, feature_type, scale,
+                      compaction, data):
+        return self.upsert('descriptor_compaction', {
+            'sequence': sequence, 'detector_type': detector_type,
+            'feature_type': feature_type, 'scale': scale,
+            'compaction': compaction, **self.blobColumns(data)})
+
+    def getVocabulary(self, feature_type, compaction, words):
+        self.cur.execute(
+            'SELECT data, codec from visual_vocabulary '
+            'WHERE feature_type = ? AND compaction = ? AND words = ?',
+            (feature_type, compaction, words))
+        row = self.cur.fetchone()
+        if row:
+            return self.from_blob(row[0], row[1])
+        else:
+            return None
+
+    def putVocabulary(self, feature_type, compaction, words, time, data):
+        return self.upsert('visual_vocabulary', {
+            'feature_type': feature_type, 'compaction': compaction,
+            'words': words, 'time': time, **self.blobColumns(data)})
+
+    def getRetrievalIndex(self, sequence, detector_type, feature_type, scale,
+                          compaction, selection, words, tiling=''):
+        self.cur.execute(
+            'SELECT data, codec from retrieval_index WHERE sequence = ? '
+            'AND detector_type = ? AND feature_type = ? AND scale = ? '
+            'AND compaction = ? AND selection = ? AND words = ? '
+            'AND tiling = ?',
+            (sequence, detector_type, feature_type, scale, compaction,
+             selection, words, tiling))
+        row = self.cur.fetchone()
+        if row:
+            return self.from_blob(row[0], row[1])
+        else:
+            return None
+
+    def putRetrievalIndex(self, sequence, detector_type, feature_type, scale,
+                          compaction, selection, words, time, data,
+                          tiling=''):
+        return self.upsert('retrieval_index', {
+            'sequence': sequence, 'detector_type': detector_type,
+            'feature_type': feature_type, 'scale': scale,
+            'compaction': compaction, 'selection': selection, 'words': words,
+            'time': time, **self.blobColumns(data), 'tiling': tiling})
+
+    def getKeypoints(self, image, detector_type, params, scale=1):
+        values = self.queued('image_keypoint', image, detector_type, params,
+                             scale)
+        if values:
+            return (self.from_blob(values['data'], values['codec']),
+                    values['time'])
+        self.cur.execute(
+            'SELECT time, data, codec from image_keypoint WHERE image = ? '
+            'AND detector_type = ? AND params = ? AND scale = ?',
+            (image, detector_type, params, scale))
+        row = self.cur.fetchone()
+        if row:
+            return self.from_blob(row[1], row[2]), row[0]
+        else:
+            return None
+
+    def putKeypoints(self, image, detector_type, params, scale, time, data):
+        self.queue('image_keypoint', {
+            'image': image, 'detector_type': detector_type, 'params': params,
+            'scale': scale, 'count': len(data), 'time': time,
+            **self.blobColumns(data)})
+
+    def getMatch(self, feature1, feature2, matcher=''):
+        self.cur.execute(
+            'SELECT id, data, codec from feature_match WHERE feature1 = ? '
+            'AND feature2 = ? AND matcher = ?',
+            (feature1, feature2, matcher))
+        row = self.cur.fetchone()
+        if row:
+            return row[0], toMatchArray(self.from_blob(row[1], row[2]))
+        else:
+            return None
+
+    def getFeatureIds(self, sequence, detector_type, feature_type, scale=1,
+                      compaction='', selection='', tiling=''):
+        self.cur.execute(
+            'SELECT image_feature.image, image_feature.id '
+            f'FROM image_feature {SEQUENCE_FEATURES}',
+            (sequence, detector_type, feature_type, scale, compaction,
+             selection, tiling))
+        return dict(self.cur.fetchall())
+
+    def getFeatures(self, sequence, detector_type, feature_type, scale=1,
+                    compaction='', selection='', tiling=''):
+        self.cur.execute(
+            'SELECT image_feature.image, image_feature.id, '
+            'image_feature.data, image_feature.codec '
+            f'FROM image_feature {SEQUENCE_FEATURES}',
+            (sequence, detector_type, feature_type, scale, compaction,
+             selection, tiling))
+        features = {}
+        for image, feature_id, data, codec in self.cur.fetchall():
+            keypoints, descriptors = self.from_blob(data, codec)
+            features[image] = feature_id, (toKeypointArray(keypoints),
+                                           descriptors)
+        return features
+
+    def getMatchIds(self, sequence, detector_type, feature_type, scale=1,
+                    compaction='', selection='', tiling='', matcher=''):
+        self.cur.execute(
+            'SELECT feature_match.feature1, feature_match.feature2, '
+            'feature_match.id FROM feature_match INNER JOIN image_feature '
+            'ON feature_match.feature1 = image_feature.id '
+            f'{SEQUENCE_FEATURES} AND feature_match.matcher = ?',
+            (sequence, detector_type, feature_type, scale, compaction,
+             selection, tiling, matcher))
+        return {(feature1, feature2): match_id
+                for feature1, feature2, match_id in self.cur.fetchall()}
+
+    def getMatches(self, sequence, detector_type, feature_type, scale=1,
+                   compaction='', selection='', tiling='', matcher=''):
+        self.cur.execute(
+            'SELECT feature_match.feature1, feature_match.feature2, '
+            'feature_match.id, feature_match.data, feature_match.codec '
+            'FROM feature_match INNER JOIN image_feature '
+            'ON feature_match.feature1 = image_feature.id '
+            f'{SEQUENCE_FEATURES} AND feature_match.matcher = ?',
+            (sequence, detector_type, feature_type, scale, compaction,
+             selection, tiling, matcher))
+        return {(feature1, feature2):
+                (match_id, toMatchArray(self.from_blob(data, codec)))
+                for feature1, feature2, match_id, data, codec
+                in self.cur.fetchall()}
+
+    def getMatchId(self, feature1, feature2, matcher=''):
+        self.cur.execute(
+            'SELECT id from feature_match WHERE feature1 = ? '
+            'AND feature2 = ? AND matcher = ?',
+            (feature1, feature2, matcher))
+        row = self.cur.fetchone()
+        if row:
+            return row[0]
+        else:
+            return None
+
+    def getMatchById(self, match_id):
+        self.cur.execute('SELECT data, codec from feature_match WHERE id = ?',
+                         (match_id,))
+        row = self.cur.fetchone()
+        if row:
+            return toMatchArray(self.from_blob(row[0], row[1]))
+        else:
+            return None
+
+    def putMatch(self, feature1, feature2, count, time, data, matcher=''):
+        return self.upsert('feature_match', {
+            'feature1': feature1, 'feature2': feature2, 'count': count,
+            'time': time, **self.blobColumns(data, external=True),
+            'matcher': matcher})
+
+    def getGeometry(self, match, params):
+        values = self.queued('match_geometry', match, params)
+        if values:
+            return self.from_blob(values['data'], values['codec'])
+        self.cur.execute('SELECT data, codec from match_geometry '
+                         'WHERE match = ? AND params = ?',
+                         (match, params))
+        row = self.cur.fetchone()
+        if row:
+            return self.from_blob(row[0], row[1])
+        else:
+            return None
+
+    def putGeometry(self, match, params, config, count, time, data):
+        self.queue('match_geometry', {
+            'match': match, 'params': params, 'config': config, 'count': count,
+            'time': time, **self.blobColumns(data)})
+
+    def putAnalysis(self, sequence, detector_type, feature_type, points,
+                    observations, error, scale=1, compaction='', selection='',
+                    matcher='', tiling='', pairs='', verification='colmap'):
+        self.cur.execute(
+            'INSERT INTO analysis(sequence, detector_type, feature_type, '
+            'points, observations, error, scale, compaction, selection, '
+            'matcher, tiling, pairs, verification) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (sequence, detector_type, feature_type, points, observations,
+             error, scale, compaction, selection, matcher, tiling, pairs,
+             verification))
+        row_id = self.cur.lastrowid
+        self.written()
+        return row_id
+
+
+class SharedDatabase:
+    # Get-or-create lookups insert rows, so they belong to the writer.
+    WRITER_GETTERS = ['getSequenceId', 'getFeatureTypeId', 'getImageId']
+
+    def __init__(self, database_path, codec=DEFAULT_CODEC, store_path=None,
+                 batch_size=1000):
+        self.database_path = database_path
+        self.codec = codec
+        self.store_path = store_path
+        self.batch_size = batch_size
+        self.requests = queue.Queue()
+        self.thread_local = threading.local()
+        ready = Future()
+        self.thread = threading.Thread(target=self.write, args=(ready,),
+                                       daemon=True)
+        self.thread.start()
+        ready.result()
+
+    def write(self, ready):
+        # Checkpoints are left to the writer, it commits every batch it drains.
+        try:
+            database = Database(self.database_path, self.codec,
+                                self.store_path, commit_rows=None,
+                                commit_seconds=None)
+        except BaseException as error:
+            ready.set_exception(error)
+            return
+        ready.set_result(None)
+        closed = False
+        while not closed:
+            results, closed = self.execute(database, self.drain())
+            try:
+                database.commit()
+            except BaseException as error:
+                results = [(future, None, error) for future, _, _ in results]
+            # Results are released once committed, so every reader sees them.
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        database.close()
+
+    def drain(self):
+        batch = [self.requests.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def execute(self, database, batch):
+        results = []
+        closed = False
+        for request in batch:
+            if request is None:
+                closed = True
+                continue
+            future, name, args, kwargs = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                results.append(
+                    (future, getattr(database, name)(*args, **kwargs), None))
+            except BaseException as error:
+                results.append((future, None, error))
+        return results, closed
+
+    def submit(self, name, *args, **kwargs):
+        future = Future()
+        self.requests.put((future, name, args, kwargs))
+        return future
+
+    def reader(self):
+        return Database(self.database_path, self.codec, self.store_path,
+                        readonly=True)
+
+    def threadReader(self):
+        if not hasattr(self.thread_local, 'database'):
+            self.thread_local.database = Database(
+                self.database_path, self.codec, self.store_path, readonly=True)
+        return self.thread_local.database
+
+    def __getattr__(self, name):
+        if name.startswith('get') and name not in self.WRITER_GETTERS:
+            return getattr(self.threadReader(), name)
+        if name == 'cur':
+            return self.threadReader().cur
+        return lambda *args, **kwargs: \
+            self.submit(name, *args, **kwargs).result()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.requests.put(None)
+            self.thread.join()
+        if hasattr(self.thread_local, 'database'):
+            self.thread_local.database.close()
@@ -1,13 +1,18 @@
 import os
 import re
 import sys
+import cv2
 import numpy as np
 import glob
 import time
+import itertools
 import logging
 import subprocess
 from .database import Database
-from ..experiment import Experiment
+from ..experiment import Experiment, matcherName
+from ..features.cache import ImageCache, KeypointCache
+from ..features.pairs import pairsName
+from ..features.extractor import Extractor, tilingName
 
 
 class Dataset:
@@ -21,108 +26,326 @@ class Dataset:
         for sequence in glob.glob(os.path.join(self.path, '*/')):
             self.sequences[sequence.split(os.sep)[-2]] = sequence
 
-    def evaluate(self, database, databases_path, point_clouds_path, detector_types, feature_types):
+    def experimentName(self, sequence, detector_type, feature_type, scale=1,
+                       compaction=None, compaction_dimensions=32, selection='',
+                       pairs='', matcher='', tiling='', verification='colmap'):
+        name = f'{sequence}_{detector_type}_{feature_type}'
+        if scale != 1:
+            name += f'_{scale:g}'
+        if tiling:
+            name += f'_{tiling}'
+        if selection:
+            name += f'_{selection}'
+        if compaction:
+            name += f'_{compaction}'
+            if compaction == 'pca':
+                name += f'{compaction_dimensions}'
+        if pairs:
+            name += f'_{pairs}'
+        if matcher:
+            name += f'_{matcher}'
+        if verification != 'colmap':
+            name += f'_{verification}'
+        return name
+
+    def compacts(self, detector_type, feature_type, compaction):
+        # Binary descriptors are never compacted, such a run would only repeat
+        # the uncompacted one under another name.
+        if not compaction:
+            return True
+        try:
+            extractor = Extractor(detector_type, feature_type)
+        except Exception:
+            # The run itself reports invalid feature types.
+            return True
+        if extractor.descriptor.descriptorType() == cv2.CV_32F:
+            return True
+        logging.warning('Skipped compaction of binary <%s> descriptors',
+                        feature_type)
+        return False
+
+    def extract(self, database, point_clouds_path, sequence, folder,
+                detector_types, feature_types, image_cache, keypoint_cache,
+                scale=1, compaction=None, compaction_dimensions=32, pairs='',
+                matcher='', verification='colmap', **options):
+        image_path = os.path.join(folder, 'images')
+        tiling = tilingName(options.get('tile_size'),
+                            options.get('tile_overlap', 64))
+        experiments = []
+        for detector_type in detector_types:
+            for feature_type in feature_types:
+                # Combinations evaluate skips or has already reconstructed
+                # need no features.
+                name = self.experimentName(
+                    sequence, detector_type, feature_type, scale, compaction,
+                    compaction_dimensions, options.get('selection', ''),
+                    pairs, matcher, tiling, verification)
+                if not self.compacts(detector_type, feature_type,
+                                     compaction) or \
+                        os.path.exists(os.path.join(point_clouds_path, name,
+                                                    '0')):
+                    continue
+                try:
+                    experiment = Experiment(
+                        self.K, database, sequence, image_path,
+                        self.image_format, detector_type, feature_type,
+                        keypoint_cache=keypoint_cache, image_cache=image_cache,
+                        max_resident_views=0, scale=scale, **options)
+                    feature_ids = database.getFeatureIds(
+                        *experiment.featureKey())
+                    experiments.append((experiment, experiment.listViews(),
+                                        feature_ids))
+                except Exception as e:
+                    print(e)
+        if not experiments:
+            return
+        tic = time.time()
+        for idx in range(len(experiments[0][1])):
+            for entry in list(experiments):
+                experiment, views, feature_ids = entry
+                if not self.extractView(experiment, views[idx], feature_ids):
+                    # A failing combination is dropped, the others go on.
+                    experiments.remove(entry)
+                views[idx] = None
+            image_cache.clear()
+        toc = time.time()
+        logging.info('Extracted %d combinations in %f seconds',
+                     len(experiments), toc - tic)
+        database.commit()
+
+    def extractView(self, experiment, view, feature_ids):
+        try:
+            if view.image_id not in feature_ids:
+                experiment.extractViews([view])
+            return True
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            print(e)
+            return False
+
+    def evaluate(self, database, databases_path, point_clouds_path,
+                 detector_types, feature_types,
+                 workers=1, image_cache_size=2 * 1024 ** 3,
+                 schedule='combination', keypoint_cache_size=256 * 1024 ** 2,
+                 max_resident_views=None, tile_size=None, tile_overlap=64,
+                 tile_workers=1, scales=1, compaction=None,
+                 compaction_dimensions=32, selection='', match_workers=1,
+                 pair_strategy='exhaustive', pair_window=10, pair_period=50,
+                 pair_list_path=None, retrieval_words=256,
+                 matcher_backend='bf', match_ratio=None, match_batch=1,
+                 verification='colmap', stream=False, match_block=None):
+        if pair_strategy == 'file' and not pair_list_path:
+            logging.error('Invalid pair list path for pair strategy <file>!')
+            raise Exception('Invalid pair list path for pair strategy <file>!')
+        scales = scales if isinstance(scales, (list, tuple)) else [scales]
+        matcher = matcherName(matcher_backend, match_ratio)
+        tiling = tilingName(tile_size, tile_overlap)
         for sequence, folder in self.sequences.items():
             print(f' {sequence} '.center(60, '='))
-            for detector_type in detector_types:
+            image_cache = ImageCache(image_cache_size)
+            # Raw detections are reused by every descriptor of a detector.
+            keypoint_cache = KeypointCache(keypoint_cache_size)
+            pair_path = os.path.join(folder, pair_list_path) \
+                if pair_list_path else None
+            pairs = pairsName(pair_strategy, pair_window, pair_period,
+                              pair_path)
+            options = dict(workers=workers, keypoint_cache=keypoint_cache,
+                           image_cache=image_cache,
+                           max_resident_views=max_resident_views,
+                           tile_size=tile_size, tile_overlap=tile_overlap,
+                           tile_workers=tile_workers, compaction=compaction,
+                           compaction_dimensions=compaction_dimensions,
+                           selection=selection, match_workers=match_workers,
+                           pair_strategy=pair_strategy,
+                           pair_window=pair_window, pair_period=pair_period,
+                           pair_list_path=pair_path,
+                           retrieval_words=retrieval_words,
+                           matcher_backend=matcher_backend,
+                           match_ratio=match_ratio, match_batch=match_batch,
+                           match_block=match_block)
+            if schedule == 'image':
+                for scale in scales:
+                    self.extract(database, point_clouds_path, sequence, folder,
+                                 detector_types, feature_types,
+                                 image_cache, keypoint_cache, scale,
+                                 compaction, compaction_dimensions, pairs,
+                                 matcher, verification, tile_size=tile_size,
+                                 tile_overlap=tile_overlap,
+                                 tile_workers=tile_workers,
+                                 selection=selection)
+            for scale, detector_type in itertools.product(scales,
+                                                          detector_types):
                 for feature_type in feature_types:
-                    print(f' {detector_type}_{feature_type} '.center(60, '-'))
-                    try:
-                        point_cloud_path = os.path.join(
-                            point_clouds_path, f'{sequence}_{detector_type}_{feature_type}')
-                        if os.path.exists(os.path.join(point_cloud_path, '0')):
-                            continue
-                        if not os.path.exists(point_cloud_path):
-                            os.makedirs(point_cloud_path)
-                        image_path = os.path.join(folder, 'images')
-                        experiment = Experiment(self.K,
-                                                database,
-                                                sequence,
-                                                image_path,
-                                                self.image_format,
-                                                detector_type,
-                                                feature_type,
-                                                )
-                        tic = time.time()
-                        experiment.createViews()
-                        toc = time.time()
-                        logging.info('Processed %d views in %f seconds',
-                                     len(experiment.views), toc - tic)
-                        tic = time.time()
-                        experiment.createMatches()
-                        toc = time.time()
-                        logging.info('Processed %d pairs in %f seconds',
-                                     len(experiment.matches), toc - tic)
-                        colmap_db_path = os.path.join(
-                            databases_path, f'{sequence}_{detector_type}_{feature_type}.sqlite')
-                        if os.path.exists(colmap_db_path):
-                            os.remove(colmap_db_path)
-                        experiment.toColmap(colmap_db_path)
-                        colmap_log = bytes()
-                        ret = subprocess.check_output([
-                            'colmap',
-                            'feature_extractor',
-                            '--database_path', colmap_db_path,
-                            '--image_path', image_path,
-                            '--SiftExtraction.use_gpu', '0',
-                        ],
-                            stderr=subprocess.PIPE)
-                        ret = subprocess.check_output([
-                            'colmap',
-                            'exhaustive_matcher',
-                            '--database_path', colmap_db_path,
-                            '--SiftMatching.use_gpu', '0',
-                        ],
-                            stderr=subprocess.PIPE)
-                        ret = subprocess.check_output([
-                            'colmap',
-                            'mapper',
-                            '--database_path', colmap_db_path,
-                            '--image_path', image_path,
-                            '--output_path', point_cloud_path,
-                        ],
-                            stderr=subprocess.PIPE)
-                        colmap_log += ret
-                        ret = subprocess.check_output([
-                            'colmap',
-                            'model_analyzer',
-                            '--path', os.path.join(point_cloud_path, '0'),
-                        ],
-                            stderr=subprocess.PIPE)
-                        analysis = {}
-                        for line in ret.decode('utf-8').strip().split('\n'):
-                            key, value = line.split(':')
-                            analysis[key.strip().lower()
-                                     ] = value.strip().lower()
-                        database.putAnalysis(experiment.sequence_id,
-                                             experiment.detector_type_id,
-                                             experiment.feature_type_id,
-                                             int(analysis['points']),
-                                             int(analysis['observations']),
-                                             float(analysis['mean reprojection error'].replace('px', '')))
-                        colmap_log += ret
-                        ret = subprocess.check_output([
-                            'colmap',
-                            'model_converter',
-                            '--input_path', os.path.join(
-                                point_cloud_path, '0'),
-                            '--output_path', os.path.join(
-                                point_cloud_path, '0.ply'),
-                            '--output_type', 'PLY',
-                        ],
-                            stderr=subprocess.PIPE)
-                        print(re.findall(
-                            r'Initializing with image pair #\d+ and #\d+', colmap_log.decode('utf-8'))[-1])
-                        print(re.findall(
-                            r'Elapsed time: \d+.\d+ \[minutes\]', colmap_log.decode('utf-8'))[-1])
-                        print(re.findall(r'Points: \d+',
-                              colmap_log.decode('utf-8'))[-1])
-                        print(re.findall(
-                            r'Mean reprojection error: \d+.\d+px', colmap_log.decode('utf-8'))[-1])
-                    except KeyboardInterrupt:
-                        raise
-                    except Exception as e:
-                        print(e)
-                    except:
-                        print(sys.exc_info())
-                    database.commit()
+                    if not self.compacts(detector_type, feature_type,
+                                         compaction):
+                        continue
+                    name = self.experimentName(
+                        sequence, detector_type, feature_type, scale,
+                        compaction, compaction_dimensions, selection,
+                        pairs, matcher, tiling, verification)
+                    print(f' {name[len(sequence) + 1:]} '.center(60, '-'))
+                    self.evaluateExperiment(
+                        database, databases_path, point_clouds_path, name,
+                        folder, sequence, detector_type, feature_type,
+                        dict(options, scale=scale), pairs, verification,
+                        stream)
+
+    def evaluateExperiment(self, database, databases_path, point_clouds_path,
+                           name, folder, sequence, detector_type, feature_type,
+                           options, pairs='', verification='colmap',
+                           stream=False):
+        try:
+            point_cloud_path = os.path.join(point_clouds_path, name)
+            if os.path.exists(os.path.join(point_cloud_path, '0')):
+                return
+            if not os.path.exists(point_cloud_path):
+                os.makedirs(point_cloud_path)
+            image_path = os.path.join(folder, 'images')
+            experiment = Experiment(self.K,
+                                    database,
+                                    sequence,
+                                    image_path,
+                                    self.image_format,
+                                    detector_type,
+                                    feature_type,
+                                    **options,
+                                    )
+            colmap_db_path = os.path.join(databases_path, f'{name}.sqlite')
+            self.matchExperiment(experiment, colmap_db_path, verification,
+                                 stream)
+            analysis, colmap_log = self.reconstruct(
+                experiment, colmap_db_path, image_path, point_cloud_path,
+                verification)
+            compaction = experiment.compactor.name if experiment.compactor \
+                else ''
+            database.putAnalysis(experiment.sequence_id,
+                                 experiment.detector_type_id,
+                                 experiment.feature_type_id,
+                                 int(analysis['points']),
+                                 int(analysis['observations']),
+                                 float(analysis['mean reprojection error']
+                                       .replace('px', '')),
+                                 experiment.scale,
+                                 compaction,
+                                 experiment.selection,
+                                 experiment.matcher_name,
+                                 experiment.extractor.tiling,
+                                 pairs, verification)
+            subprocess.check_output([
+                'colmap',
+                'model_converter',
+                '--input_path', os.path.join(
+                    point_cloud_path, '0'),
+                '--output_path', os.path.join(
+                    point_cloud_path, '0.ply'),
+                '--output_type', 'PLY',
+            ],
+                stderr=subprocess.PIPE)
+            colmap_log = colmap_log.decode('utf-8')
+            print(re.findall(
+                r'Initializing with image pair #\d+ and #\d+', colmap_log)[-1])
+            print(re.findall(
+                r'Elapsed time: \d+.\d+ \[minutes\]', colmap_log)[-1])
+            print(re.findall(r'Points: \d+', colmap_log)[-1])
+            print(re.findall(
+                r'Mean reprojection error: \d+.\d+px', colmap_log)[-1])
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            print(e)
+        except:
+            print(sys.exc_info())
+        database.commit()
+
+    def matchExperiment(self, experiment, colmap_db_path,
+                        verification='colmap', stream=False):
+        tic = time.time()
+        experiment.createViews()
+        toc = time.time()
+        logging.info('Processed %d views in %f seconds',
+                     len(experiment.views), toc - tic)
+        if os.path.exists(colmap_db_path):
+            os.remove(colmap_db_path)
+        if stream:
+            # Each pair goes to both databases as soon as it is matched.
+            writer = experiment.openColmap(colmap_db_path)
+            tic = time.time()
+            experiment.createMatches(
+                writer, verify=verification == 'experiment')
+            writer.close()
+            toc = time.time()
+            logging.info('Processed %d pairs in %f seconds',
+                         len(experiment.match_ids), toc - tic)
+            logging.info('Matching stats %s', experiment.matchStats())
+            return
+        tic = time.time()
+        experiment.createMatches()
+        toc = time.time()
+        logging.info('Processed %d pairs in %f seconds',
+                     len(experiment.matches), toc - tic)
+        logging.info('Matching stats %s', experiment.matchStats())
+        if verification == 'experiment':
+            tic = time.time()
+            experiment.verifyMatches()
+            toc = time.time()
+            logging.info('Verified %d pairs in %f seconds',
+                         len(experiment.geometries), toc - tic)
+        experiment.toColmap(colmap_db_path)
+
+    def reconstruct(self, experiment, colmap_db_path, image_path,
+                    point_cloud_path, verification='colmap'):
+        colmap_log = bytes()
+        # In-process verification already wrote the two-view geometries.
+        if verification != 'experiment':
+            ret = subprocess.check_output([
+                'colmap',
+                'feature_extractor',
+                '--database_path', colmap_db_path,
+                '--image_path', image_path,
+                '--SiftExtraction.use_gpu', '0',
+            ],
+                stderr=subprocess.PIPE)
+            if experiment.pair_strategy == 'exhaustive':
+                ret = subprocess.check_output([
+                    'colmap',
+                    'exhaustive_matcher',
+                    '--database_path', colmap_db_path,
+                    '--SiftMatching.use_gpu', '0',
+                ],
+                    stderr=subprocess.PIPE)
+            else:
+                # Verify only the scheduled pairs, the others have no matches.
+                pairs_path = f'{os.path.splitext(colmap_db_path)[0]}.txt'
+                experiment.writePairs(pairs_path)
+                ret = subprocess.check_output([
+                    'colmap',
+                    'matches_importer',
+                    '--database_path', colmap_db_path,
+                    '--match_list_path', pairs_path,
+                    '--match_type', 'pairs',
+                    '--SiftMatching.use_gpu', '0',
+                ],
+                    stderr=subprocess.PIPE)
+        ret = subprocess.check_output([
+            'colmap',
+            'mapper',
+            '--database_path', colmap_db_path,
+            '--image_path', image_path,
+            '--output_path', point_cloud_path,
+        ],
+            stderr=subprocess.PIPE)
+        colmap_log += ret
+        ret = subprocess.check_output([
+            'colmap',
+            'model_analyzer',
+            '--path', os.path.join(point_cloud_path, '0'),
+        ],
+            stderr=subprocess.PIPE)
+        analysis = {}
+        for line in ret.decode('utf-8').strip().split('\n'):
+            key, value = line.split(':')
+            analysis[key.strip().lower()
+                     ] = value.strip().lower()
+        colmap_log += ret
+        return analysis, colmap_log
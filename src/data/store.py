@@ -0,0 +1,84 @@
+import io
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+
+
+# Codec recorded for rows whose arrays live in the array store.
+STORE_CODEC = 'npy'
+
+
+class ArrayStore:
+    def __init__(self, store_path, mmap=True):
+        self.store_path = store_path
+        self.mmap = mmap
+        os.makedirs(store_path, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.store_path, digest[:2], f'{digest}.npy')
+
+    def putArray(self, array):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+        content = buffer.getbuffer()
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent writers of the same content race to an identical file,
+            # each from a temporary file of its own.
+            handle, temp_path = tempfile.mkstemp(
+                suffix='.tmp', dir=os.path.dirname(path))
+            with os.fdopen(handle, 'wb') as file:
+                file.write(content)
+            # Temporary files are private, stored arrays are readable as usual.
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        return digest
+
+    def getArray(self, digest):
+        return np.load(self.path(digest), mmap_mode='r' if self.mmap else None,
+                       allow_pickle=False)
+
+    def toRefs(self, data):
+        if isinstance(data, np.ndarray) and not data.dtype.hasobject:
+            return {STORE_CODEC: self.putArray(data)}
+        elif isinstance(data, (tuple, list)):
+            return type(data)(self.toRefs(item) for item in data)
+        elif isinstance(data, dict):
+            return {key: self.toRefs(value) for key, value in data.items()}
+        return data
+
+    def fromRefs(self, data):
+        if isinstance(data, dict):
+            if list(data) == [STORE_CODEC]:
+                return self.getArray(data[STORE_CODEC])
+            return {key: self.fromRefs(value) for key, value in data.items()}
+        elif isinstance(data, (tuple, list)):
+            return type(data)(self.fromRefs(item) for item in data)
+        return data
+
+    def digests(self, data):
+        if isinstance(data, dict):
+            if list(data) == [STORE_CODEC]:
+                yield data[STORE_CODEC]
+            else:
+                for value in data.values():
+                    yield from self.digests(value)
+        elif isinstance(data, (tuple, list)):
+            for item in data:
+                yield from self.digests(item)
+
+    def size(self, blob):
+        # Bytes a row keeps in the store, shared files counted for each row.
+        return len(blob) + sum(os.path.getsize(self.path(digest))
+                               for digest in self.digests(pickle.loads(blob)))
+
+    def encode(self, data):
+        # Only the digests and the structure around them go to the database.
+        return pickle.dumps(self.toRefs(data), protocol=5)
+
+    def decode(self, blob):
+        return self.fromRefs(pickle.loads(blob))
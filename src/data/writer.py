@@ -0,0 +1,52 @@
+import os
+import numpy as np
+from ..colmap import database as cmdb
+
+
+class ColmapWriter:
+    def __init__(self, colmap_db_path, batch_size=1000, databases=()):
+        self.colmap_db = cmdb.COLMAPDatabase.connect(colmap_db_path)
+        self.colmap_db.create_tables()
+        self.batch_size = batch_size
+        self.databases = databases
+        self.pending = 0
+
+    def addCamera(self, width, height, K):
+        return self.colmap_db.add_camera(
+            1, width, height, [K[0, 0], K[1, 1], K[0, 2], K[1, 2]])
+
+    def addView(self, view, camera_id):
+        _, image_name = os.path.split(view.image_path)
+        view.colmap_id = self.colmap_db.add_image(image_name, camera_id)
+        self.colmap_db.add_keypoints(
+            view.colmap_id, np.column_stack((view.keypoints['pt'],
+                                             view.keypoints['size'],
+                                             view.keypoints['angle'])))
+        self.colmap_db.add_descriptors(view.colmap_id, np.zeros(
+            (len(view.keypoints), 128), dtype=int))
+
+    def addMatches(self, view1, view2, matches, geometry=None):
+        self.colmap_db.add_matches(
+            view1.colmap_id, view2.colmap_id,
+            np.column_stack((matches['queryIdx'], matches['trainIdx'])))
+        if geometry is not None:
+            # Geometries relate the first image of the pair to the second.
+            inliers = matches[geometry['inliers']]
+            self.colmap_db.add_two_view_geometry(
+                view2.colmap_id, view1.colmap_id,
+                np.column_stack((inliers['trainIdx'], inliers['queryIdx'])),
+                geometry['F'], geometry['E'], geometry['H'],
+                geometry['qvec'], geometry['tvec'], geometry['config'])
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        self.colmap_db.commit()
+        for database in self.databases:
+            database.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.colmap_db.close()
@@ -1,126 +1,623 @@
+import cv2
 import glob
 import time
 import os
+import logging
+import threading
 import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from .features.extractor import Extractor
 from .features.matcher import Matcher
+from .features.compactor import Compactor
 from .features.view import View
-from .colmap import database as cmdb
+from .features.cache import ImageCache, KeypointCache
+from .features import keypoint as kp
+from .features import pairs as pr
+from .features.retrieval import Vocabulary, RetrievalIndex
+from .features.verifier import Verifier
+from .data.writer import ColmapWriter
 
 
 class Experiment:
     def __init__(self, K, database, sequence, root_path,
                  image_format='jpg', detector_type='SIFT', feature_type='SIFT',
-                 max_features=2000, max_matches=500):
+                 max_features=2000, max_matches=500, workers=1,
+                 keypoint_cache=None, image_cache=None,
+                 max_resident_views=None, tile_size=None, tile_overlap=64,
+                 tile_workers=1, scale=1, compaction=None,
+                 compaction_dimensions=32, selection='', match_workers=1,
+                 pair_strategy='exhaustive', pair_window=10, pair_period=50,
+                 pair_list_path=None, retrieval_words=256,
+                 matcher_backend='bf', match_ratio=None, match_batch=1,
+                 match_block=None):
         self.K = K
         self.database = database
         self.sequence_id = database.getSequenceId(sequence)
         self.feature_type = feature_type
         self.detector_type_id = database.getFeatureTypeId(detector_type)
         self.feature_type_id = database.getFeatureTypeId(feature_type)
+        self.scale = scale
+        if selection not in ['', 'anms', 'grid']:
+            logging.error(f'Invalid selection <{selection}>!')
+            raise Exception(f'Invalid selection <{selection}>!')
+        self.selection = selection
+        if pair_strategy not in pr.PAIR_STRATEGIES:
+            logging.error(f'Invalid pair strategy <{pair_strategy}>!')
+            raise Exception(f'Invalid pair strategy <{pair_strategy}>!')
+        self.pair_strategy = pair_strategy
+        self.pair_window = pair_window
+        self.pair_period = pair_period
+        self.pair_list_path = pair_list_path
+        self.retrieval_words = retrieval_words
         self.root_path = root_path
         self.image_format = image_format
-        self.extractor = Extractor(detector_type, feature_type)
+        self.extractor = Extractor(detector_type, feature_type,
+                                   tile_size, tile_overlap, tile_workers)
+        self.keypoint_type_id = database.getFeatureTypeId(
+            self.extractor.detector_type)
+        self.keypoint_cache = KeypointCache() if keypoint_cache is None \
+            else keypoint_cache
+        self.image_cache = ImageCache() if image_cache is None else image_cache
+        self.compactor = None
+        if compaction:
+            if self.extractor.descriptor.descriptorType() == cv2.CV_32F:
+                self.compactor = Compactor(compaction, compaction_dimensions)
+            else:
+                logging.warning(
+                    'Skipped compaction of binary <%s> descriptors',
+                    feature_type)
         self.matcher = Matcher(
-            self.extractor.descriptor.defaultNorm(), crossCheck=True)
+            self.extractor.descriptor.defaultNorm(), crossCheck=True,
+            backend=matcher_backend, ratio=match_ratio)
+        # Brute-force matches keep the key they were stored with before.
+        self.matcher_name = matcherName(matcher_backend, match_ratio)
         self.max_features = max_features
         self.max_matches = max_matches
+        self.workers = workers
+        self.match_workers = match_workers
+        self.match_batch = match_batch
+        self.match_block = match_block
+        if match_block and max_resident_views is None:
+            # Two blocks of views are matched against each other at a time.
+            max_resident_views = 2 * match_block
+        self.thread_local = threading.local()
+        self.max_resident_views = max_resident_views
+        self.resident = OrderedDict()
+        self.resident_bytes = {}
+        self.resident_nbytes = 0
+        self.prefetched = {}
+        self.match_stats = {}
         self.views = []
         self.matches = {}
+        self.match_ids = {}
+        self.geometries = {}
 
     def createViews(self):
-        self.views = []
+        self.views = self.listViews()
+        self.resident = OrderedDict()
+        self.resident_bytes = {}
+        self.resident_nbytes = 0
+        pending = []
+        uncompacted = []
+        feature_ids = self.database.getFeatureIds(*self.featureKey())
+        compact_ids = self.database.getFeatureIds(
+            *self.featureKey(self.compactor.name)) if self.compactor else {}
+        for view in self.views:
+            if self.compactor and self.loadFeature(view, self.compactor.name,
+                                                   compact_ids):
+                self.makeResident(view)
+            elif self.loadFeature(view, feature_ids=feature_ids):
+                self.makeResident(view)
+                uncompacted.append(view)
+            else:
+                pending.append(view)
+        self.extractViews(pending)
+        if self.compactor:
+            self.compactViews(sorted(uncompacted + pending,
+                                     key=lambda view: view.idx))
+        # Queued rows are written out at the end of every stage.
+        self.database.commit()
+
+    def listViews(self):
         files = sorted(glob.glob(os.path.join(
             self.root_path, '*.' + self.image_format)))
-        keypoints_count = 0
+        views = []
         for idx, file in enumerate(files):
             file = os.path.abspath(file)
-            view = View(idx, self.database.getImageId(
-                file, self.sequence_id), os.path.join(self.root_path, file))
-            view.load()
+            views.append(View(idx, self.database.getImageId(
+                file, self.sequence_id), os.path.join(self.root_path, file)))
+        return views
+
+    def featureKey(self, compaction=''):
+        return (self.sequence_id, self.detector_type_id, self.feature_type_id,
+                self.scale, compaction, self.selection, self.extractor.tiling)
+
+    def loadFeature(self, view, compaction='', feature_ids=None):
+        if feature_ids is None:
             feature = self.database.getFeature(
-                view.image_id, self.detector_type_id, self.feature_type_id)
-            if feature:
-                view.setFeatureID(feature[0])
-                view.setFeature(feature[1])
-                keypoints_count += len(feature[1][0])
+                view.image_id, self.detector_type_id, self.feature_type_id,
+                self.scale, compaction, self.selection, self.extractor.tiling)
+        elif view.image_id in feature_ids:
+            feature_id = feature_ids[view.image_id]
+            feature = (feature_id, self.database.getFeatureById(feature_id))
+        else:
+            feature = None
+        if feature:
+            view.setFeatureID(feature[0])
+            view.setFeature(feature[1])
+            return True
+        return False
+
+    def extractViews(self, views):
+        for view, feature in zip(views, self.extractFeatures(views)):
+            if feature.detected is not None:
+                self.putKeypoints(view, feature.detected,
+                                  feature.detection_time)
+            view.setFeature((feature.keypoints, feature.descriptors))
+            view.setFeatureID(
+                self.database.putFeature(view.image_id,
+                                         self.detector_type_id,
+                                         self.feature_type_id, feature.count,
+                                         view.descriptors.nbytes, feature.time,
+                                         (view.keypoints, view.descriptors),
+                                         feature.detection_time,
+                                         feature.description_time,
+                                         self.scale, selection=self.selection,
+                                         selection_time=feature.selection_time,
+                                         tiling=self.extractor.tiling))
+            self.makeResident(view)
+
+    def compactViews(self, views):
+        if not views:
+            return
+        key = (self.sequence_id, self.detector_type_id, self.feature_type_id,
+               self.scale, self.compactor.name)
+        self.compactor.params = self.database.getCompaction(*key)
+        if self.compactor.params is None:
+            step = max(1, len(views) // 50)
+            samples = []
+            for view in views[::step]:
+                self.makeResident(view)
+                samples.append(view.descriptors)
+            self.database.putCompaction(*key, self.compactor.fit(samples))
+        for view in views:
+            self.makeResident(view)
+            count, extraction_time, detection_time, description_time, \
+                selection_time = self.database.getFeatureInfo(view.feature_id)
+            tic = time.process_time()
+            view.descriptors = self.compactor.transform(view.descriptors)
+            toc = time.process_time()
+            view.setFeatureID(
+                self.database.putFeature(view.image_id,
+                                         self.detector_type_id,
+                                         self.feature_type_id, count,
+                                         view.descriptors.nbytes,
+                                         extraction_time + toc - tic,
+                                         (view.keypoints, view.descriptors),
+                                         detection_time, description_time,
+                                         self.scale, self.compactor.name,
+                                         toc - tic,
+                                         self.selection, selection_time,
+                                         self.extractor.tiling))
+
+    def makeResident(self, view):
+        if view.descriptors is None:
+            if view.idx in self.prefetched:
+                view.descriptors = self.prefetched.pop(view.idx)
+                self.countStat('prefetched')
             else:
-                tic2 = time.time()
-                keypoints, descriptors = self.extractor.extract(view)
-                keypoints_count += len(keypoints)
-                toc2 = time.time()
-                sort_order = np.argsort(
-                    [-keypoint.response for keypoint in keypoints])
-                sort_order = sort_order[:min(
-                    self.max_features, len(sort_order))]
-                view.keypoints = [AttrDict({
-                    'pt': keypoints[i].pt,
-                    'size':keypoints[i].size,
-                    'angle':keypoints[i].angle,
-                    'class_id':keypoints[i].class_id,
-                    'octave':keypoints[i].octave,
-                    'response':keypoints[i].response
-                }) for i in sort_order]
-                view.descriptors = np.array(
-                    [descriptors[i] for i in sort_order])
-                view.setFeatureID(
-                    self.database.putFeature(view.image_id,
-                                             self.detector_type_id,
-                                             self.feature_type_id, len(
-                                                 keypoints),
-                                             view.descriptors.nbytes, toc2 - tic2, (view.keypoints, view.descriptors)))
-            self.views.append(view)
-
-    def createMatches(self):
+                view.descriptors = self.database.getFeatureById(
+                    view.feature_id)[1]
+                self.countStat('loaded')
+        self.resident[view.idx] = view
+        self.resident.move_to_end(view.idx)
+        self.resident_nbytes += view.descriptors.nbytes - \
+            self.resident_bytes.get(view.idx, 0)
+        self.resident_bytes[view.idx] = view.descriptors.nbytes
+        if self.max_resident_views is not None:
+            while len(self.resident) > max(2, self.max_resident_views):
+                idx, evicted = self.resident.popitem(last=False)
+                evicted.releaseDescriptors()
+                self.resident_nbytes -= self.resident_bytes.pop(idx)
+        if self.resident_nbytes > self.match_stats.get('peak_bytes', 0):
+            self.match_stats['peak_bytes'] = self.resident_nbytes
+
+    def countStat(self, name, value=1):
+        self.match_stats[name] = self.match_stats.get(name, 0) + value
+
+    def getKeypoints(self, view):
+        if self.extractor.detector is None:
+            return None
+        key = (view.image_id, self.keypoint_type_id,
+               self.extractor.detector_params, self.scale)
+        keypoints = self.keypoint_cache.get(key)
+        if keypoints is None:
+            keypoints = self.database.getKeypoints(*key)
+            if keypoints is None:
+                return None
+            self.keypoint_cache.put(key, keypoints)
+        return keypoints
+
+    def putKeypoints(self, view, keypoints, detection_time):
+        key = (view.image_id, self.keypoint_type_id,
+               self.extractor.detector_params, self.scale)
+        self.database.putKeypoints(*key, detection_time, keypoints)
+        self.keypoint_cache.put(key, (keypoints, detection_time))
+
+    def extractFeatures(self, views):
+        if self.workers > 1 and len(views) > 1:
+            initargs = (self.extractor.detector_type,
+                        self.extractor.feature_type,
+                        self.extractor.tile_size,
+                        self.extractor.tile_overlap,
+                        self.extractor.tile_workers)
+            with ProcessPoolExecutor(min(self.workers, len(views)),
+                                     initializer=_initWorker,
+                                     initargs=initargs) as executor:
+                futures = deque()
+                for view in views:
+                    view.load(self.image_cache, self.extractor.color,
+                              self.scale)
+                    futures.append(executor.submit(
+                        _extractImage, view.image, self.max_features,
+                        self.getKeypoints(view), self.selection))
+                    view.unload()
+                    if len(futures) >= 2 * self.workers:
+                        yield futures.popleft().result()
+                while futures:
+                    yield futures.popleft().result()
+        else:
+            for view in views:
+                view.load(self.image_cache, self.extractor.color, self.scale)
+                feature = _extract(self.extractor, view.image,
+                                   self.max_features, self.getKeypoints(view),
+                                   self.selection)
+                view.unload()
+                yield feature
+
+    def createMatches(self, writer=None, verify=False):
+        self.match_stats = {}
         self.matches = {}
-        matches_count = 0
-        for i in range(0, len(self.views)-1):
-            for j in range(i+1, len(self.views)):
-                match = self.database.getMatch(
-                    self.views[j].feature_id, self.views[i].feature_id)
-                if match:
-                    self.matches[(j, i)] = match[1]
-                    matches_count += len(match[1])
-                else:
-                    tic2 = time.time()
-                    matches = self.matcher.match(
-                        self.views[j], self.views[i])
-                    toc2 = time.time()
-                    matches_count += len(matches)
-                    self.matches[(j, i)] = [AttrDict({
-                        'imgIdx': match.imgIdx,
-                        'queryIdx': match.queryIdx,
-                        'trainIdx': match.trainIdx,
-                        'distance': match.distance
-                    }) for match in matches[:min(self.max_matches, len(matches))]]
-                    self.database.putMatch(self.views[j].feature_id, self.views[i].feature_id,
-                                           len(matches), toc2 - tic2, self.matches[(j, i)])
+        self.match_ids = {}
+        self.geometries = {}
+        stream = self.streamMatches()
+        if verify:
+            stream = self.streamGeometries(stream)
+        for pair, matches, geometry in stream:
+            if writer is None:
+                self.matches[pair] = matches
+                if verify:
+                    self.geometries[pair] = geometry
+            else:
+                # Streamed pairs are written out and not kept in memory.
+                writer.addMatches(self.views[pair[0]], self.views[pair[1]],
+                                  matches, geometry)
+        self.database.commit()
 
-    def toColmap(self, colmap_db_path):
-        colmap_db = cmdb.COLMAPDatabase.connect(colmap_db_path)
-        colmap_db.create_tables()
-        fx, fy, cx, cy, s = (self.K[0, 0], self.K[1, 1],
-                             self.K[0, 2], self.K[1, 2],
-                             self.K[0, 1])
-        camera_id = colmap_db.add_camera(1,
-                                         self.views[0].image.shape[1],
-                                         self.views[0].image.shape[0],
-                                         [fx, fy, cx, cy])
+    def streamMatches(self):
+        pairs = self.selectPairs()
+        if self.match_block:
+            pairs = sorted(pairs, key=lambda pair: (
+                pair[1] // self.match_block, pair[0] // self.match_block))
+        cached = self.database.getMatchIds(
+            *self.featureKey(self.compactor.name if self.compactor else ''),
+            self.matcher_name)
+        match_ids = [cached.get((self.views[j].feature_id,
+                                 self.views[i].feature_id)) for j, i in pairs]
+        computed = self.matchPairs([
+            pair for pair, match_id in zip(pairs, match_ids)
+            if match_id is None])
+        for (j, i), match_id in zip(pairs, match_ids):
+            if match_id is None:
+                matches, count, match_time = next(computed)
+                match_id = self.database.putMatch(
+                    self.views[j].feature_id, self.views[i].feature_id,
+                    count, match_time, matches, self.matcher_name)
+            else:
+                matches = self.database.getMatchById(match_id)
+            self.match_ids[(j, i)] = match_id
+            yield (j, i), matches, None
+        # Let the matching pipeline finish and record its statistics.
+        next(computed, None)
+
+    def selectPairs(self):
+        names = [os.path.split(view.image_path)[1] for view in self.views]
+        neighbors = None
+        if self.pair_strategy == 'retrieval':
+            neighbors = self.retrieve(self.pair_window)
+        return pr.selectPairs(self.pair_strategy, names, self.pair_window,
+                              self.pair_period, self.pair_list_path, neighbors)
+
+    def retrieve(self, k):
+        compaction = self.compactor.name if self.compactor else ''
+        vocabulary = Vocabulary(
+            self.retrieval_words,
+            self.matcher.normType in [cv2.NORM_HAMMING, cv2.NORM_HAMMING2])
+        vocabulary.centers = self.database.getVocabulary(
+            self.feature_type_id, compaction, self.retrieval_words)
+        if vocabulary.centers is None:
+            step = max(1, len(self.views) // 100)
+            samples = []
+            for view in self.views[::step]:
+                self.makeResident(view)
+                samples.append(view.descriptors)
+            tic = time.time()
+            vocabulary.fit(samples)
+            toc = time.time()
+            self.database.putVocabulary(self.feature_type_id, compaction,
+                                        self.retrieval_words, toc - tic,
+                                        vocabulary.centers)
+        key = (self.sequence_id, self.detector_type_id, self.feature_type_id,
+               self.scale, compaction, self.selection, self.retrieval_words)
+        image_ids = [view.image_id for view in self.views]
+        data = self.database.getRetrievalIndex(*key, self.extractor.tiling)
+        if data is not None and data[0] == image_ids:
+            index = RetrievalIndex(*data)
+        else:
+            histograms = []
+            tic = time.time()
+            for view in self.views:
+                self.makeResident(view)
+                histograms.append(vocabulary.histogram(view.descriptors))
+            index = RetrievalIndex().build(image_ids, histograms)
+            toc = time.time()
+            self.database.putRetrievalIndex(*key, toc - tic, index.toData(),
+                                            self.extractor.tiling)
+        return index.query(k)
+
+    def writePairs(self, pairs_path):
+        with open(pairs_path, 'w') as file:
+            for j, i in self.match_ids:
+                file.write(f'{os.path.split(self.views[j].image_path)[1]} '
+                           f'{os.path.split(self.views[i].image_path)[1]}\n')
+
+    def matchPairs(self, pairs):
+        tiles = self.tilePairs(pairs)
+        if len(tiles) > 1:
+            # The prefetch connection only sees committed features.
+            self.database.commit()
+        tic = time.time()
+        with ThreadPoolExecutor(1) as prefetcher, \
+                ThreadPoolExecutor(max(1, self.match_workers)) as executor:
+            try:
+                prefetch = None
+                futures = deque()
+                for idx, tile in enumerate(tiles):
+                    if prefetch is not None:
+                        self.prefetched = prefetch.result()
+                        self.match_stats['peak_bytes'] = max(
+                            self.match_stats.get('peak_bytes', 0),
+                            self.resident_nbytes + sum(
+                                descriptors.nbytes
+                                for descriptors in self.prefetched.values()))
+                    if idx + 1 < len(tiles):
+                        # Load the next tile while this one is matched.
+                        prefetch = prefetcher.submit(
+                            self.prefetchDescriptors,
+                            self.tileViews(tiles[idx + 1], tile))
+                    for group in self.groupPairs(tile):
+                        if self.match_workers <= 1:
+                            yield from self.matchGroup(
+                                *self.groupDescriptors(group))
+                            continue
+                        futures.append(executor.submit(
+                            self.matchGroup, *self.groupDescriptors(group)))
+                        if len(futures) >= 2 * self.match_workers:
+                            yield from futures.popleft().result()
+                while futures:
+                    yield from futures.popleft().result()
+            finally:
+                # The prefetch thread ends with the pool, so does its reader.
+                prefetcher.submit(self.closeReader)
+        self.prefetched = {}
+        self.countStat('pairs', len(pairs))
+        self.countStat('time', time.time() - tic)
+
+    def tilePairs(self, pairs):
+        if not self.match_block:
+            return [pairs] if pairs else []
+        tiles = []
+        for j, i in pairs:
+            tile = (i // self.match_block, j // self.match_block)
+            if not tiles or tiles[-1][0] != tile:
+                tiles.append((tile, []))
+            tiles[-1][1].append((j, i))
+        return [tile for _, tile in tiles]
+
+    def tileViews(self, tile, current):
+        # Views of the current tile are the most recently used, they stay.
+        indices = {idx for pair in tile for idx in pair} - \
+            {idx for pair in current for idx in pair}
+        return [self.views[idx] for idx in sorted(indices)]
+
+    def closeReader(self):
+        if hasattr(self.thread_local, 'database'):
+            self.thread_local.database.close()
+            del self.thread_local.database
+
+    def prefetchDescriptors(self, views):
+        if not hasattr(self.thread_local, 'database'):
+            self.thread_local.database = self.database.reader()
+        return {view.idx: self.thread_local.database.getFeatureById(
+            view.feature_id)[1] for view in views}
+
+    def matchStats(self):
+        stats = dict(self.match_stats)
+        stats['pairs_per_second'] = stats.get('pairs', 0) / \
+            max(stats.get('time', 0), 1e-12)
+        return stats
+
+    def groupPairs(self, pairs):
+        # Consecutive pairs sharing a train view are matched in one call.
+        groups = []
+        for j, i in pairs:
+            if groups and groups[-1][0][1] == i and \
+                    len(groups[-1]) < self.match_batch:
+                groups[-1].append((j, i))
+            else:
+                groups.append([(j, i)])
+        return groups
+
+    def groupDescriptors(self, group):
+        queries = []
+        self.makeResident(self.views[group[0][1]])
+        train = self.views[group[0][1]].descriptors
+        for j, _ in group:
+            self.makeResident(self.views[j])
+            queries.append(self.views[j].descriptors)
+        return queries, train
+
+    def matchGroup(self, queries, train):
+        if not hasattr(self.thread_local, 'matcher'):
+            self.thread_local.matcher = Matcher(self.matcher.normType,
+                                                self.matcher.crossCheck,
+                                                self.matcher.backend,
+                                                self.matcher.ratio)
+        tic = time.time()
+        if len(queries) == 1:
+            results = [self.thread_local.matcher.matchDescriptors(
+                queries[0], train, self.max_matches)]
+        else:
+            results = self.thread_local.matcher.matchMany(
+                queries, train, self.max_matches)
+        toc = time.time()
+        # A batch's time is shared out by the size of each query.
+        sizes = np.array([len(query) for query in queries], dtype=np.float64)
+        shares = sizes / sizes.sum() if sizes.sum() else \
+            np.full(len(queries), 1 / len(queries))
+        return [(matches, count, (toc - tic) * share)
+                for (matches, count), share in zip(results, shares)]
+
+    def verifyMatches(self):
+        self.geometries = {}
+        for pair, _, geometry in self.streamGeometries(
+                (pair, matches, None)
+                for pair, matches in self.matches.items()):
+            self.geometries[pair] = geometry
+        self.database.commit()
+
+    def streamGeometries(self, stream):
+        verifier = Verifier(self.cameraMatrix())
+        with ThreadPoolExecutor(max(1, self.match_workers)) as executor:
+            futures = deque()
+            for pair, matches, _ in stream:
+                geometry = self.database.getGeometry(self.match_ids[pair],
+                                                     verifier.params)
+                if geometry is None:
+                    geometry = executor.submit(self.verifyPair, verifier,
+                                               pair, matches)
+                futures.append((pair, matches, geometry))
+                if len(futures) >= 2 * self.match_workers:
+                    yield self.resolveGeometry(verifier, *futures.popleft())
+            while futures:
+                yield self.resolveGeometry(verifier, *futures.popleft())
+
+    def resolveGeometry(self, verifier, pair, matches, geometry):
+        if not isinstance(geometry, dict):
+            geometry, verify_time = geometry.result()
+            self.putGeometry(verifier, pair, geometry, verify_time)
+        return pair, matches, geometry
+
+    def verifyPair(self, verifier, pair, matches):
+        j, i = pair
+        tic = time.time()
+        geometry = verifier.verify(
+            self.views[i].keypoints['pt'][matches['trainIdx']],
+            self.views[j].keypoints['pt'][matches['queryIdx']],
+            j * len(self.views) + i)
+        toc = time.time()
+        return geometry, toc - tic
+
+    def putGeometry(self, verifier, pair, geometry, verify_time):
+        self.database.putGeometry(self.match_ids[pair], verifier.params,
+                                  geometry['config'], len(geometry['inliers']),
+                                  verify_time, geometry)
+
+    def cameraMatrix(self):
+        # Scale about pixel corners, K has pixel centers at integer
+        # coordinates.
+        return np.array([[self.K[0, 0] * self.scale, 0,
+                          (self.K[0, 2] + 0.5) * self.scale - 0.5],
+                         [0, self.K[1, 1] * self.scale,
+                          (self.K[1, 2] + 0.5) * self.scale - 0.5],
+                         [0, 0, 1]])
+
+    def openColmap(self, colmap_db_path, batch_size=1000):
+        writer = ColmapWriter(colmap_db_path, batch_size, [self.database])
+        if self.views[0].image_size is None:
+            self.views[0].load(self.image_cache, scale=self.scale)
+            self.views[0].unload()
+        height, width = self.views[0].image_size
+        camera_id = writer.addCamera(width, height, self.cameraMatrix())
         for view in self.views:
-            _, image_name = os.path.split(view.image_path)
-            view.colmap_id = colmap_db.add_image(image_name, camera_id)
-            colmap_db.add_keypoints(view.colmap_id,
-                                    np.array([[keypoint.pt[0], keypoint.pt[1], keypoint.size, keypoint.angle]
-                                              for keypoint in view.keypoints], dtype=float))
-            colmap_db.add_descriptors(view.colmap_id, np.zeros(
-                (len(view.keypoints), 128), dtype=int))
+            writer.addView(view, camera_id)
+        return writer
+
+    def toColmap(self, colmap_db_path):
+        writer = self.openColmap(colmap_db_path)
         for pair in self.matches:
-            colmap_db.add_matches(
-                self.views[pair[0]].colmap_id,
-                self.views[pair[1]].colmap_id,
-                np.array([[match.queryIdx, match.trainIdx] for match in self.matches[pair]], dtype=int))
-        colmap_db.commit()
-        colmap_db.close()
+            writer.addMatches(self.views[pair[0]], self.views[pair[1]],
+                              self.matches[pair], self.geometries.get(pair))
+        writer.close()
+
+
+def matcherName(backend='bf', ratio=None):
+    name = '' if backend == 'bf' else backend
+    if ratio:
+        name += f'ratio{ratio:g}'
+    return name
+
+
+_worker_extractor = None
+
+
+def _initWorker(detector_type, feature_type,
+                tile_size=None, tile_overlap=64, tile_workers=1):
+    global _worker_extractor
+    # Workers run OpenCV single threaded so they do not oversubscribe the
+    # cores. Extraction is timed in CPU time, which matches the serial path
+    # where OpenCV spreads the same work over its own thread pool.
+    cv2.setNumThreads(1)
+    _worker_extractor = Extractor(detector_type, feature_type,
+                                  tile_size, tile_overlap, tile_workers)
+
+
+def _extractImage(image, max_features, detected=None, selection=''):
+    return _extract(_worker_extractor, image, max_features, detected,
+                    selection)
+
+
+def _extract(extractor, image, max_features, detected=None, selection=''):
+    feature = AttrDict(detected=None, detection_time=None,
+                       description_time=None)
+    if extractor.detector is None:
+        tic = time.process_time()
+        keypoints, descriptors = extractor.extract(image)
+        toc = time.process_time()
+        feature.time = toc - tic
+    else:
+        if detected is None:
+            tic = time.process_time()
+            feature.detected = extractor.detect(image)
+            toc = time.process_time()
+            feature.detection_time = toc - tic
+        else:
+            feature.detected, feature.detection_time = detected
+        tic = time.process_time()
+        keypoints, descriptors = extractor.compute(image, feature.detected)
+        toc = time.process_time()
+        feature.description_time = toc - tic
+        feature.time = feature.detection_time + feature.description_time
+        if detected is not None:
+            feature.detected = None
+    feature.count = len(keypoints)
+    tic = time.process_time()
+    feature.keypoints, feature.descriptors = kp.select(
+        keypoints, descriptors, max_features, selection, image.shape[:2])
+    toc = time.process_time()
+    feature.selection_time = toc - tic
+    return feature
 
 
 class AttrDict(dict):
@@ -0,0 +1,89 @@
+import cv2
+import threading
+from collections import OrderedDict
+
+
+# Downscale factors that JPEG decoders can produce directly while decoding.
+REDUCED_COLOR = {
+    1 / 2: cv2.IMREAD_REDUCED_COLOR_2,
+    1 / 4: cv2.IMREAD_REDUCED_COLOR_4,
+    1 / 8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def loadImage(image_path, color=False, scale=1):
+    if scale in REDUCED_COLOR:
+        image = cv2.imread(image_path, REDUCED_COLOR[scale])
+    else:
+        image = cv2.imread(image_path)
+        if image is not None and scale != 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale,
+                               interpolation=cv2.INTER_AREA)
+    if image is None or color:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+class ImageCache:
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, image_path, color=False, scale=1):
+        key = (image_path, color, scale)
+        with self.lock:
+            if key in self.images:
+                self.images.move_to_end(key)
+                return self.images[key]
+        image = loadImage(image_path, color, scale)
+        if image is not None:
+            self.put(key, image)
+        return image
+
+    def put(self, key, image):
+        with self.lock:
+            if key in self.images:
+                return
+            self.images[key] = image
+            self.nbytes += image.nbytes
+            while self.nbytes > self.max_bytes and len(self.images) > 1:
+                _, evicted = self.images.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.nbytes = 0
+
+
+class KeypointCache:
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.keypoints = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.keypoints:
+                self.keypoints.move_to_end(key)
+                return self.keypoints[key]
+        return None
+
+    def put(self, key, keypoints):
+        # Entries are (keypoints, detection_time) pairs.
+        with self.lock:
+            if key in self.keypoints:
+                self.nbytes -= self.keypoints.pop(key)[0].nbytes
+            self.keypoints[key] = keypoints
+            self.nbytes += keypoints[0].nbytes
+            while self.nbytes > self.max_bytes and len(self.keypoints) > 1:
+                _, evicted = self.keypoints.popitem(last=False)
+                self.nbytes -= evicted[0].nbytes
+
+    def clear(self):
+        with self.lock:
+            self.keypoints.clear()
+            self.nbytes = 0
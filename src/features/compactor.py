@@ -0,0 +1,39 @@
+import logging
+import numpy as np
+
+
+class Compactor:
+    def __init__(self, mode, dimensions=32, max_samples=100000):
+        if mode not in ['uint8', 'pca']:
+            logging.error(f'Invalid compaction mode <{mode}>!')
+            raise Exception(f'Invalid compaction mode <{mode}>!')
+        self.mode = mode
+        self.dimensions = dimensions
+        self.max_samples = max_samples
+        self.name = mode if mode == 'uint8' else f'{mode}{dimensions}'
+        self.params = None
+
+    def fit(self, descriptors):
+        descriptors = np.concatenate(descriptors).astype(np.float32)
+        if len(descriptors) > self.max_samples:
+            descriptors = descriptors[np.random.default_rng(0).choice(
+                len(descriptors), self.max_samples, replace=False)]
+        if self.mode == 'uint8':
+            # One range for all dimensions keeps L2 distances proportional.
+            low, high = np.percentile(descriptors, [0.1, 99.9])
+            self.params = (np.float32(low),
+                           np.float32(255 / max(high - low, 1e-12)))
+        else:
+            mean = descriptors.mean(axis=0)
+            _, _, basis = np.linalg.svd(descriptors - mean,
+                                        full_matrices=False)
+            self.params = (mean, basis[:self.dimensions].astype(np.float32))
+        return self.params
+
+    def transform(self, descriptors):
+        if self.mode == 'uint8':
+            low, scale = self.params
+            return np.clip(np.rint((descriptors - low) * scale),
+                           0, 255).astype(np.uint8)
+        mean, basis = self.params
+        return ((descriptors - mean) @ basis.T).astype(np.float32)
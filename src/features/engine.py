@@ -0,0 +1,104 @@
+import numpy as np
+
+
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)],
+                    dtype=np.float32)
+
+
+def prepare(descriptors, binary=False):
+    # Hamming distances come from popcounts and a dot product of unpacked bits,
+    # exact in float32 for descriptors up to 2^24 bits.
+    if binary:
+        return (np.unpackbits(descriptors, axis=1).astype(np.float32),
+                POPCOUNT[descriptors].sum(axis=1))
+    descriptors = descriptors.astype(np.float32)
+    return descriptors, np.einsum('ij,ij->i', descriptors, descriptors)
+
+
+def mutualMatches(descriptors1, descriptors2, binary=False, ratio=None,
+                  limit=None, block_elements=2 ** 23, cross_check=True):
+    return mutualMatchesMany([descriptors1], descriptors2, binary, ratio,
+                             limit, block_elements, cross_check)[0]
+
+
+def mutualMatchesMany(queries, train, binary=False, ratio=None, limit=None,
+                      block_elements=2 ** 23, cross_check=True):
+    # Train descriptors are the rows and every query view is a segment of the
+    # columns, so a whole one-vs-many batch shares each matrix product.
+    vectors1, norms1 = prepare(np.concatenate(queries), binary)
+    vectors2, norms2 = prepare(train, binary)
+    offsets = np.cumsum([0] + [len(query) for query in queries])
+    forward = np.zeros(len(vectors1), dtype=np.int64)
+    forward_distance = np.full(len(vectors1), np.inf, dtype=np.float32)
+    second_distance = np.full(len(vectors1), np.inf, dtype=np.float32)
+    backward = np.zeros((len(queries), len(vectors2)), dtype=np.int64)
+    block_size = max(2, block_elements // max(len(vectors1), 1))
+    for start in range(0, len(vectors2), block_size):
+        stop = min(start + block_size, len(vectors2))
+        distances = vectors2[start:stop] @ vectors1.T
+        distances *= -2
+        distances += norms2[start:stop, np.newaxis]
+        distances += norms1
+        nearest = distances.argmin(axis=0)
+        nearest_distance = distances[nearest, np.arange(len(vectors1))]
+        if ratio is not None:
+            if stop - start > 1:
+                second = np.partition(distances, 1, axis=0)[1]
+            else:
+                second = np.full(len(vectors1), np.inf, dtype=np.float32)
+            second_distance = np.minimum(
+                np.maximum(forward_distance, nearest_distance),
+                np.minimum(second_distance, second))
+        # Strictly smaller keeps the first train row on ties, as BFMatcher
+        # does.
+        better = nearest_distance < forward_distance
+        forward[better] = nearest[better] + start
+        forward_distance[better] = nearest_distance[better]
+        for idx in range(len(queries) if cross_check else 0):
+            if offsets[idx + 1] > offsets[idx]:
+                backward[idx, start:stop] = distances[
+                    :, offsets[idx]:offsets[idx + 1]].argmin(axis=1)
+    results = []
+    for idx in range(len(queries)):
+        low, high = offsets[idx], offsets[idx + 1]
+        results.append(selectMatches(
+            vectors1[low:high], vectors2, forward[low:high],
+            forward_distance[low:high], second_distance[low:high],
+            backward[idx] if cross_check else None, binary, ratio, limit))
+    return results
+
+
+def selectMatches(vectors1, vectors2, forward, forward_distance,
+                  second_distance, backward, binary, ratio, limit):
+    if len(vectors2) == 0:
+        query = np.empty(0, dtype=np.int64)
+    elif backward is None:
+        # Without the cross check every query keeps its nearest neighbour.
+        query = np.arange(len(vectors1))
+    else:
+        query = np.flatnonzero(backward[forward] == np.arange(len(vectors1)))
+    if ratio is not None:
+        first = np.maximum(forward_distance[query], 0)
+        second = np.maximum(second_distance[query], 0)
+        if not binary:
+            # Squared L2 distances, compare against the squared ratio.
+            ratio = ratio * ratio
+        query = query[first < ratio * second]
+    train = forward[query]
+    if binary:
+        distance = forward_distance[query]
+    else:
+        difference = vectors1[query] - vectors2[train]
+        distance = np.sqrt(np.einsum('ij,ij->i', difference, difference))
+    count = len(query)
+    if limit is not None and limit < count:
+        # Keep the first matches of a stable sort by distance, ties in query
+        # order.
+        kth = np.partition(distance, limit - 1)[limit - 1]
+        lower = np.flatnonzero(distance < kth)
+        equal = np.flatnonzero(distance == kth)[:limit - len(lower)]
+        selected = np.sort(np.concatenate((lower, equal)))
+        query, train, distance = \
+            query[selected], train[selected], distance[selected]
+    order = np.argsort(distance, kind='stable')
+    return query[order], train[order], distance[order], count
@@ -1,53 +1,136 @@
 import cv2
+import json
 import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from . import keypoint as kp
+
+
+# Factories are looked up when first used, builds may lack some of them.
+FEATURE_ALGORITHMS = {
+    'SIFT': 'xfeatures2d.SIFT_create',
+    'SURF': 'xfeatures2d.SURF_create',
+    'DAISY': 'xfeatures2d.DAISY_create',
+    'BRISK': 'BRISK_create',
+    'KAZE': 'KAZE_create',
+    'AKAZE': 'AKAZE_create',
+    'ORB': 'ORB_create',
+    'FREAK': 'xfeatures2d.FREAK_create',
+    'BRIEF': 'xfeatures2d.BriefDescriptorExtractor_create',
+    'LUCID': 'xfeatures2d.LUCID_create',
+    'LATCH': 'xfeatures2d.LATCH_create',
+    'BEBLID': 'xfeatures2d.BEBLID_create',
+    'TEBLID': 'xfeatures2d.TEBLID_create',
+    'VGG': 'xfeatures2d.VGG_create',
+    'FAST': 'FastFeatureDetector_create',
+    'AGAST': 'AgastFeatureDetector_create',
+    'STAR': 'xfeatures2d.StarDetector_create',
+}
+
+FEATURE_PARAMS = {
+    'SIFT': {},
+    'SURF': {'extended': True},
+    'DAISY': {'use_orientation': True},
+    'BRISK': {},
+    'KAZE': {'extended': True},
+    'AKAZE': {'descriptor_size': 0, 'descriptor_channels': 3},
+    'ORB': {'nfeatures': 20000},
+    'FREAK': {},
+    'BRIEF': {'bytes': 64, 'use_orientation': True},
+    'LUCID': {'lucid_kernel': 15, 'blur_kernel': 2},
+    'LATCH': {'bytes': 64, 'rotationInvariance': True},
+    'BEBLID': {'n_bits': 101},
+    'TEBLID': {'n_bits': 103},
+    'VGG': {'desc': 100},
+    'FAST': {},
+    'AGAST': {},
+    'STAR': {'maxSize': 128, 'responseThreshold': 10},
+}
+
+# Keypoint scale factors of the learned descriptors, by detector type.
+SCALE_FACTORS = {
+    'BEBLID': {'ORB': 1, 'SIFT': 6.75, 'SURF': 6.25, 'KAZE': 6.25, None: 5.00},
+    'TEBLID': {'ORB': 1, 'SIFT': 6.75, 'SURF': 6.25, 'KAZE': 6.25, None: 5.00},
+    'VGG': {'ORB': 0.75, 'SIFT': 6.75, 'SURF': 6.25, 'KAZE': 6.25, None: 5.00},
+}
+
+# Features computed on the colour image rather than on its grayscale.
+COLOR_FEATURES = ['LUCID']
+
+_algorithms = {}
+
+
+def algorithmParams(name, detector_type=None):
+    params = dict(FEATURE_PARAMS[name])
+    if name in SCALE_FACTORS:
+        scale_factors = SCALE_FACTORS[name]
+        params['scale_factor'] = scale_factors.get(
+            detector_type, scale_factors[None])
+    return params
+
+
+def algorithmFactory(name):
+    factory = cv2
+    for attribute in FEATURE_ALGORITHMS[name].split('.'):
+        factory = getattr(factory, attribute, None)
+    return factory
+
+
+def createAlgorithm(name, params):
+    factory = algorithmFactory(name)
+    if factory is None:
+        logging.error(f'Invalid feature type <{name}> '
+                      f'for OpenCV {cv2.__version__}!')
+        raise Exception(f'Invalid feature type <{name}> '
+                        f'for OpenCV {cv2.__version__}!')
+    return factory(**params)
+
+
+def getAlgorithm(name, params):
+    key = (name, json.dumps(params, sort_keys=True))
+    if key not in _algorithms:
+        _algorithms[key] = createAlgorithm(name, params)
+    return _algorithms[key]
+
+
+def clearAlgorithms():
+    _algorithms.clear()
+
+
+def tilingName(tile_size=None, tile_overlap=64):
+    return f'tile{tile_size}x{tile_overlap}' if tile_size else ''
 
 
 class Extractor:
-    def __init__(self, detector_type, feature_type):
+    def __init__(self, detector_type, feature_type,
+                 tile_size=None, tile_overlap=64, tile_workers=1):
         self.feature_type = feature_type
         self.detector_type = detector_type
-        feature_algorithm = {
-            'SIFT': cv2.xfeatures2d.SIFT_create(),
-            'SURF': cv2.xfeatures2d.SURF_create(extended=True),
-            'DAISY': cv2.xfeatures2d.DAISY_create(use_orientation=True),
-            'BRISK': cv2.BRISK_create(),
-            'KAZE': cv2.KAZE_create(extended=True),
-            'AKAZE': cv2.AKAZE_create(descriptor_size=0, descriptor_channels=3),
-            'ORB': cv2.ORB_create(nfeatures=20000),
-            'FREAK': cv2.xfeatures2d.FREAK_create(),
-            'BRIEF': cv2.xfeatures2d.BriefDescriptorExtractor_create(bytes=64, use_orientation=True),
-            'LUCID': cv2.xfeatures2d.LUCID_create(lucid_kernel=15, blur_kernel=2),
-            'LATCH': cv2.xfeatures2d.LATCH_create(bytes=64, rotationInvariance=True),
-            'BEBLID': cv2.xfeatures2d.BEBLID_create(n_bits=101, scale_factor=1 if self.detector_type == 'ORB' else
-                                                    6.75 if self.detector_type == 'SIFT' else
-                                                    6.25 if self.detector_type in ['SURF', 'KAZE'] else
-                                                    5.00),
-            'TEBLID': cv2.xfeatures2d.TEBLID_create(n_bits=103, scale_factor=1 if self.detector_type == 'ORB' else
-                                                    6.75 if self.detector_type == 'SIFT' else
-                                                    6.25 if self.detector_type in ['SURF', 'KAZE'] else
-                                                    5.00),
-            'VGG': cv2.xfeatures2d.VGG_create(desc=100, scale_factor=0.75 if self.detector_type == 'ORB' else
-                                              6.75 if self.detector_type == 'SIFT' else
-                                              6.25 if self.detector_type in ['SURF', 'KAZE'] else
-                                              5.00),
-            'FAST': cv2.FastFeatureDetector_create(),
-            'AGAST': cv2.AgastFeatureDetector_create(),
-            'STAR': cv2.xfeatures2d.StarDetector_create(maxSize=128, responseThreshold=10),
-        }
-        if self.feature_type in feature_algorithm:
-            if self.detector_type in feature_algorithm:
-                self.detector = feature_algorithm[self.detector_type]
-                self.descriptor = feature_algorithm[self.feature_type]
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers
+        self.tile_executor = None
+        self.thread_local = threading.local()
+        if self.feature_type in FEATURE_ALGORITHMS:
+            self.descriptor_params = algorithmParams(self.feature_type,
+                                                     self.detector_type)
+            self.descriptor = getAlgorithm(self.feature_type,
+                                           self.descriptor_params)
+            if self.detector_type in FEATURE_ALGORITHMS:
+                self.detector = getAlgorithm(
+                    self.detector_type, algorithmParams(self.detector_type))
             elif self.detector_type is None:
                 self.detector = None
                 self.detector_type = self.feature_type
-                self.descriptor = feature_algorithm[self.feature_type]
                 try:
                     self.descriptor.detectAndCompute(None, None)
                 except Exception as e:
                     if e.code == cv2.Error.StsNotImplemented:
                         self.detector_type = 'FAST'
-                        self.detector = feature_algorithm[self.detector_type]
+                        self.detector = getAlgorithm(
+                            self.detector_type,
+                            algorithmParams(self.detector_type))
                     else:
                         pass
             else:
@@ -57,21 +140,136 @@ class Extractor:
         else:
             logging.error(f'Invalid feature type <{self.feature_type}>!')
             raise Exception(f'Invalid feature type <{self.feature_type}>!')
+        detector_params = algorithmParams(self.detector_type)
+        if self.tile_size:
+            detector_params['tile_size'] = self.tile_size
+            detector_params['tile_overlap'] = self.tile_overlap
+        self.tiling = tilingName(self.tile_size, self.tile_overlap)
+        self.detector_params = json.dumps(detector_params, sort_keys=True)
+        self.color = (self.detector_type in COLOR_FEATURES or
+                      self.feature_type in COLOR_FEATURES)
+
+    def detect(self, image):
+        if self.isTiled(image):
+            tiles = self.mapTiles(self.detectTile, image)
+            keypoints = np.concatenate(tiles)
+            return keypoints[kp.uniqueIndices(keypoints,
+                                              self.tileIndices(tiles))]
+        return kp.fromKeyPoints(self.detector.detect(image, None))
+
+    def compute(self, image, keypoints):
+        keypoints = keypoints.copy()
+        if len(keypoints) and self.feature_type in ['AKAZE', 'KAZE']:
+            keypoints['class_id'] += 1 - keypoints['class_id'].min()
+        elif self.feature_type in ['DAISY']:
+            keypoints['angle'] = np.maximum(0, keypoints['angle'])
+        if self.isTiled(image):
+            features = self.mapTiles(
+                lambda image, tile: self.computeTile(image, tile, keypoints),
+                image)
+            return (np.concatenate([keypoints for keypoints, _ in features]),
+                    np.concatenate([descriptors
+                                    for _, descriptors in features]))
+        keypoints, descriptors = self.descriptor.compute(
+            image, kp.toKeyPoints(keypoints))
+        return self.toArrays(keypoints, descriptors)
 
-    def extract(self, view):
+    def extract(self, image):
         if self.detector:
-            keypoints = self.detector.detect(view.image, None)
-            if self.feature_type in ['AKAZE', 'KAZE']:
-                min_class_id = min(
-                    [keypoint.class_id for keypoint in keypoints])
-                for keypoint in keypoints:
-                    keypoint.class_id += 1 - min_class_id
-            elif self.feature_type in ['DAISY']:
-                for keypoint in keypoints:
-                    keypoint.angle = max(0, keypoint.angle)
-            keypoints, descriptors = self.descriptor.compute(
-                view.image, keypoints)
-        else:
-            keypoints, descriptors = self.descriptor.detectAndCompute(
-                view.image, None)
-        return (keypoints, descriptors)
+            return self.compute(image, self.detect(image))
+        if self.isTiled(image):
+            features = self.mapTiles(self.extractTile, image)
+            keypoints = np.concatenate(
+                [keypoints for keypoints, _ in features])
+            descriptors = np.concatenate(
+                [descriptors for _, descriptors in features])
+            unique = kp.uniqueIndices(keypoints, self.tileIndices(
+                [keypoints for keypoints, _ in features]))
+            return keypoints[unique], descriptors[unique]
+        keypoints, descriptors = self.descriptor.detectAndCompute(image, None)
+        return self.toArrays(keypoints, descriptors)
+
+    def isTiled(self, image):
+        return bool(self.tile_size) and max(image.shape[:2]) > self.tile_size
+
+    def mapTiles(self, function, image):
+        height, width = image.shape[:2]
+        tiles = [(x, y, min(x + self.tile_size, width),
+                  min(y + self.tile_size, height))
+                 for y in range(0, height, self.tile_size)
+                 for x in range(0, width, self.tile_size)]
+        if self.tile_workers > 1:
+            if self.tile_executor is None:
+                self.tile_executor = ThreadPoolExecutor(self.tile_workers)
+            return list(self.tile_executor.map(
+                function, [image] * len(tiles), tiles))
+        return [function(image, tile) for tile in tiles]
+
+    def tileIndices(self, tiles):
+        return np.repeat(np.arange(len(tiles)), [len(tile) for tile in tiles])
+
+    def tileDetector(self):
+        # OpenCV algorithms are not thread-safe, each tile thread has its own.
+        if self.tile_workers <= 1:
+            return self.detector
+        if not hasattr(self.thread_local, 'detector'):
+            self.thread_local.detector = createAlgorithm(
+                self.detector_type, algorithmParams(self.detector_type))
+        return self.thread_local.detector
+
+    def tileDescriptor(self):
+        if self.tile_workers <= 1:
+            return self.descriptor
+        if not hasattr(self.thread_local, 'descriptor'):
+            self.thread_local.descriptor = createAlgorithm(
+                self.feature_type, self.descriptor_params)
+        return self.thread_local.descriptor
+
+    def cropTile(self, image, tile):
+        height, width = image.shape[:2]
+        x0, y0, x1, y1 = tile
+        x0, y0 = max(0, x0 - self.tile_overlap), max(0, y0 - self.tile_overlap)
+        x1 = min(width, x1 + self.tile_overlap)
+        y1 = min(height, y1 + self.tile_overlap)
+        return image[y0:y1, x0:x1], np.array([x0, y0], dtype=np.float32)
+
+    def inTile(self, keypoints, tile):
+        # Keypoints in the inner half of the overlap are kept by both tiles
+        # and deduplicated by response; the outer half suffers border effects.
+        margin = self.tile_overlap / 2
+        x, y = keypoints['pt'][:, 0], keypoints['pt'][:, 1]
+        return ((x >= tile[0] - margin) & (x < tile[2] + margin) &
+                (y >= tile[1] - margin) & (y < tile[3] + margin))
+
+    def detectTile(self, image, tile):
+        crop, offset = self.cropTile(image, tile)
+        keypoints = kp.fromKeyPoints(self.tileDetector().detect(crop, None))
+        keypoints['pt'] += offset
+        return keypoints[self.inTile(keypoints, tile)]
+
+    def computeTile(self, image, tile, keypoints):
+        crop, offset = self.cropTile(image, tile)
+        x, y = keypoints['pt'][:, 0], keypoints['pt'][:, 1]
+        keypoints = keypoints[(x >= tile[0]) & (x < tile[2]) &
+                              (y >= tile[1]) & (y < tile[3])]
+        keypoints['pt'] -= offset
+        keypoints, descriptors = self.toArrays(*self.tileDescriptor().compute(
+            crop, kp.toKeyPoints(keypoints)))
+        keypoints['pt'] += offset
+        return keypoints, descriptors
+
+    def extractTile(self, image, tile):
+        crop, offset = self.cropTile(image, tile)
+        keypoints, descriptors = self.toArrays(
+            *self.tileDescriptor().detectAndCompute(crop, None))
+        keypoints['pt'] += offset
+        inside = self.inTile(keypoints, tile)
+        return keypoints[inside], descriptors[inside]
+
+    def toArrays(self, keypoints, descriptors):
+        if descriptors is None:
+            dtype = np.float32 if self.descriptor.descriptorType() == \
+                cv2.CV_32F else np.uint8
+            descriptors = np.empty((0, self.descriptor.descriptorSize()),
+                                   dtype=dtype)
+        return (kp.fromKeyPoints(keypoints), descriptors)
@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+
+
+KEYPOINT_DTYPE = np.dtype([
+    ('pt', np.float32, (2,)),
+    ('size', np.float32),
+    ('angle', np.float32),
+    ('response', np.float32),
+    ('octave', np.int32),
+    ('class_id', np.int32),
+])
+
+
+def fromKeyPoints(keypoints):
+    return np.array([(keypoint.pt, keypoint.size, keypoint.angle,
+                      keypoint.response, keypoint.octave, keypoint.class_id)
+                     for keypoint in keypoints], dtype=KEYPOINT_DTYPE)
+
+
+def toKeyPoints(keypoints):
+    return [cv2.KeyPoint(float(x), float(y), float(size), float(angle),
+                         float(response), int(octave), int(class_id))
+            for (x, y), size, angle, response, octave, class_id
+            in keypoints.tolist()]
+
+
+def toKeypointArray(keypoints):
+    if isinstance(keypoints, np.ndarray):
+        return keypoints
+    return np.array([(keypoint['pt'], keypoint['size'], keypoint['angle'],
+                      keypoint['response'], keypoint['octave'],
+                      keypoint['class_id'])
+                     for keypoint in keypoints], dtype=KEYPOINT_DTYPE)
+
+
+def selectTop(keypoints, descriptors, max_features):
+    order = np.argsort(-keypoints['response'], kind='stable')[:max_features]
+    return keypoints[order], descriptors[order]
+
+
+def selectANMS(keypoints, descriptors, max_features, robustness=0.9,
+               block_size=512):
+    order = np.argsort(-keypoints['response'], kind='stable')
+    if len(order) <= max_features:
+        return keypoints[order], descriptors[order]
+    x, y = keypoints['pt'][order].T
+    response = keypoints['response'][order]
+    # Keypoint i is suppressed by the prefix of keypoints that are stronger
+    # than response[i] / robustness.
+    stronger = np.searchsorted(-response, -response / robustness, side='left')
+    radius = np.full(len(order), np.inf, dtype=np.float32)
+    for start in range(0, len(order), block_size):
+        stop = min(start + block_size, len(order))
+        count = stronger[stop - 1]
+        if count == 0:
+            continue
+        distances = np.square(x[start:stop, np.newaxis] - x[:count])
+        distances += np.square(y[start:stop, np.newaxis] - y[:count])
+        weaker = np.arange(count) >= stronger[start:stop, np.newaxis]
+        distances[weaker] = np.inf
+        radius[start:stop] = distances.min(axis=1)
+    order = order[np.argsort(-radius, kind='stable')[:max_features]]
+    return keypoints[order], descriptors[order]
+
+
+def selectGrid(keypoints, descriptors, max_features, image_size,
+               per_cell=4):
+    order = np.argsort(-keypoints['response'], kind='stable')
+    if len(order) <= max_features:
+        return keypoints[order], descriptors[order]
+    height, width = image_size
+    cell_size = np.sqrt(height * width * per_cell / max_features)
+    columns = int(np.ceil(width / cell_size))
+    rows = (keypoints['pt'][order, 1] // cell_size).astype(np.int64)
+    cells = rows * columns + \
+        (keypoints['pt'][order, 0] // cell_size).astype(np.int64)
+    # Rank keypoints by response inside their cell, then fill the budget one
+    # rank at a time so that every cell contributes its best keypoints first.
+    by_cell = np.argsort(cells, kind='stable')
+    first = np.searchsorted(cells[by_cell], cells[by_cell], side='left')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[by_cell] = np.arange(len(order)) - first
+    order = order[np.argsort(rank, kind='stable')[:max_features]]
+    return keypoints[order], descriptors[order]
+
+
+def select(keypoints, descriptors, max_features, selection='',
+           image_size=None):
+    if selection == 'anms':
+        return selectANMS(keypoints, descriptors, max_features)
+    elif selection == 'grid':
+        return selectGrid(keypoints, descriptors, max_features, image_size)
+    return selectTop(keypoints, descriptors, max_features)
+
+
+def uniqueIndices(keypoints, tiles):
+    # Neighbouring tiles both detect their shared overlap band. A keypoint
+    # found by several tiles keeps the copies of the strongest tile only, so
+    # keypoints of one tile at the same location (SIFT orientations) remain.
+    order = np.argsort(-keypoints['response'], kind='stable')
+    keys = np.column_stack((np.round(keypoints['pt'][order]).astype(np.int64),
+                            keypoints['octave'][order]))
+    _, first, inverse = np.unique(keys, axis=0, return_index=True,
+                                  return_inverse=True)
+    tiles = tiles[order]
+    return order[tiles == tiles[first][inverse.ravel()]]
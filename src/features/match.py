@@ -0,0 +1,32 @@
+import numpy as np
+
+
+MATCH_DTYPE = np.dtype([
+    ('queryIdx', np.int32),
+    ('trainIdx', np.int32),
+    ('distance', np.float32),
+])
+
+
+def fromDMatches(matches):
+    return np.array([(match.queryIdx, match.trainIdx, match.distance)
+                     for match in matches], dtype=MATCH_DTYPE)
+
+
+def fromArrays(query, train, distance):
+    matches = np.empty(len(query), dtype=MATCH_DTYPE)
+    matches['queryIdx'] = query
+    matches['trainIdx'] = train
+    matches['distance'] = distance
+    return matches
+
+
+def toMatchArray(matches):
+    if isinstance(matches, np.ndarray):
+        return matches
+    return np.array([(match['queryIdx'], match['trainIdx'], match['distance'])
+                     for match in matches], dtype=MATCH_DTYPE)
+
+
+def sortMatches(matches, limit=None):
+    return matches[np.argsort(matches['distance'], kind='stable')[:limit]]
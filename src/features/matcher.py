@@ -1,18 +1,87 @@
 import cv2
 import logging
+import numpy as np
+from .engine import mutualMatches, mutualMatchesMany
+from . import match as mt
+
+
+MATCHER_BACKENDS = ['bf', 'flann']
+
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
 
 
 class Matcher:
-    def __init__(self, normType, crossCheck=True):
+    def __init__(self, normType, crossCheck=True, backend='bf', ratio=None):
+        if backend not in MATCHER_BACKENDS:
+            logging.error(f'Invalid matcher backend <{backend}>!')
+            raise Exception(f'Invalid matcher backend <{backend}>!')
         self.normType = normType
-        self.matcher = cv2.BFMatcher(self.normType, crossCheck)
+        self.crossCheck = crossCheck
+        self.backend = backend
+        self.ratio = ratio
+        self.binary = normType in [cv2.NORM_HAMMING, cv2.NORM_HAMMING2]
+        # The vectorized engine replaces cross-checked or ratio-tested brute
+        # force matching.
+        self.vectorized = backend == 'bf' and (crossCheck or ratio) and \
+            normType in [cv2.NORM_L2, cv2.NORM_HAMMING]
+        if backend == 'bf':
+            self.matcher = cv2.BFMatcher(self.normType, crossCheck)
+        elif self.binary:
+            self.matcher = cv2.FlannBasedMatcher(
+                dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12,
+                     multi_probe_level=1), dict(checks=50))
+        else:
+            self.matcher = cv2.FlannBasedMatcher(
+                dict(algorithm=FLANN_INDEX_KDTREE, trees=4), dict(checks=50))
 
-    def match(self, view1, view2):
+    def match(self, view1, view2, limit=None):
         if view1 is None:
-            matches = self.matcher.match(view2.descriptors)
+            matches = mt.fromDMatches(self.matcher.match(view2.descriptors))
+            return matches, len(matches)
+        matches, count = self.matchDescriptors(
+            view1.descriptors, view2.descriptors, limit)
+        logging.debug('Matched %d features for images\n\t%s and\n\t%s',
+                      count, view1.image_path, view2.image_path)
+        return matches, count
+
+    def matchDescriptors(self, descriptors1, descriptors2, limit=None):
+        if len(descriptors1) == 0 or len(descriptors2) == 0:
+            return np.empty(0, dtype=mt.MATCH_DTYPE), 0
+        if self.vectorized:
+            query, train, distance, count = mutualMatches(
+                descriptors1, descriptors2, self.normType == cv2.NORM_HAMMING,
+                self.ratio, limit, cross_check=self.crossCheck)
+            return mt.fromArrays(query, train, distance), count
+        if self.backend == 'bf':
+            matches = self.matcher.match(descriptors1, descriptors2)
         else:
-            matches = self.matcher.match(view1.descriptors, view2.descriptors)
-            matches = sorted(matches, key=lambda x: x.distance)
-            logging.debug('Matched %d features for images\n\t%s and\n\t%s', len(
-                matches), view1.image_path, view2.image_path)
-        return matches
+            matches = self.matchFlann(descriptors1, descriptors2)
+        return mt.sortMatches(mt.fromDMatches(matches), limit), len(matches)
+
+    def matchMany(self, queries, train, limit=None):
+        if not self.vectorized or len(train) == 0:
+            return [self.matchDescriptors(query, train, limit)
+                    for query in queries]
+        return [(mt.fromArrays(query, train_idx, distance), count)
+                for query, train_idx, distance, count in mutualMatchesMany(
+                    queries, train, self.normType == cv2.NORM_HAMMING,
+                    self.ratio, limit, cross_check=self.crossCheck)]
+
+    def matchFlann(self, descriptors1, descriptors2):
+        if not self.binary:
+            descriptors1 = descriptors1.astype(np.float32, copy=False)
+            descriptors2 = descriptors2.astype(np.float32, copy=False)
+        # LSH may find no neighbour for a descriptor, knnMatch allows that.
+        forward = [match[0] for match in self.matcher.knnMatch(
+            descriptors1, descriptors2, k=1 if self.ratio is None else 2)
+            if match and (self.ratio is None or len(match) < 2 or
+                          match[0].distance < self.ratio * match[1].distance)]
+        if not self.crossCheck:
+            return forward
+        backward = np.full(len(descriptors2), -1)
+        for match in self.matcher.knnMatch(descriptors2, descriptors1, k=1):
+            if match:
+                backward[match[0].queryIdx] = match[0].trainIdx
+        return [match for match in forward
+                if backward[match.trainIdx] == match.queryIdx]
@@ -0,0 +1,74 @@
+import os
+import logging
+
+
+PAIR_STRATEGIES = ['exhaustive', 'sequential', 'loop', 'file', 'retrieval']
+
+
+def exhaustivePairs(count):
+    return [(j, i) for i in range(count - 1) for j in range(i + 1, count)]
+
+
+def sequentialPairs(count, window):
+    return [(j, i) for i in range(count - 1)
+            for j in range(i + 1, min(i + window + 1, count))]
+
+
+def loopPairs(count, window, period):
+    # Every period-th image is a loop closure candidate for all the others.
+    pairs = set(sequentialPairs(count, window))
+    keyframes = range(0, count, period)
+    pairs.update((j, i) for i in keyframes for j in keyframes if j > i)
+    return sorted(pairs, key=lambda pair: (pair[1], pair[0]))
+
+
+def filePairs(path, names):
+    indices = {name: idx for idx, name in enumerate(names)}
+    pairs = set()
+    with open(path) as file:
+        for line in file:
+            line = line.split()
+            if len(line) < 2 or line[0].startswith('#'):
+                continue
+            if line[0] not in indices or line[1] not in indices:
+                logging.warning('Skipped unknown pair <%s, %s>', *line[:2])
+                continue
+            i, j = sorted((indices[line[0]], indices[line[1]]))
+            if i != j:
+                pairs.add((j, i))
+    return sorted(pairs, key=lambda pair: (pair[1], pair[0]))
+
+
+def retrievalPairs(neighbors):
+    pairs = set()
+    for i, row in enumerate(neighbors.tolist()):
+        pairs.update((max(i, j), min(i, j)) for j in row if j != i)
+    return sorted(pairs, key=lambda pair: (pair[1], pair[0]))
+
+
+def selectPairs(strategy, names, window=10, period=50, path=None,
+                neighbors=None):
+    if strategy == 'exhaustive':
+        return exhaustivePairs(len(names))
+    elif strategy == 'sequential':
+        return sequentialPairs(len(names), window)
+    elif strategy == 'loop':
+        return loopPairs(len(names), window, period)
+    elif strategy == 'file':
+        return filePairs(path, names)
+    elif strategy == 'retrieval':
+        return retrievalPairs(neighbors)
+    logging.error(f'Invalid pair strategy <{strategy}>!')
+    raise Exception(f'Invalid pair strategy <{strategy}>!')
+
+
+def pairsName(strategy, window=10, period=50, path=None):
+    if strategy == 'sequential':
+        return f'seq{window}'
+    elif strategy == 'loop':
+        return f'loop{window}x{period}'
+    elif strategy == 'file':
+        return os.path.splitext(os.path.basename(path))[0]
+    elif strategy == 'retrieval':
+        return f'ret{window}'
+    return ''
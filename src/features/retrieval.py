@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+
+
+def toFloat(descriptors, binary=False):
+    # Squared L2 distances between unpacked bits are Hamming distances.
+    if binary:
+        return np.unpackbits(descriptors, axis=1).astype(np.float32)
+    return descriptors.astype(np.float32)
+
+
+class Vocabulary:
+    def __init__(self, words=256, binary=False, max_samples=50000):
+        self.words = words
+        self.binary = binary
+        self.max_samples = max_samples
+        self.centers = None
+        self.matcher = cv2.BFMatcher(cv2.NORM_L2)
+
+    def fit(self, descriptors):
+        descriptors = toFloat(np.concatenate(descriptors), self.binary)
+        if len(descriptors) > self.max_samples:
+            descriptors = descriptors[np.random.default_rng(0).choice(
+                len(descriptors), self.max_samples, replace=False)]
+        cv2.setRNGSeed(0)
+        _, _, self.centers = cv2.kmeans(
+            descriptors, min(self.words, len(descriptors)), None,
+            (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1e-3),
+            1, cv2.KMEANS_PP_CENTERS)
+        return self.centers
+
+    def assign(self, descriptors):
+        if len(descriptors) == 0:
+            return np.empty(0, dtype=np.int64)
+        matches = self.matcher.match(toFloat(descriptors, self.binary),
+                                     self.centers)
+        return np.array([match.trainIdx for match in matches], dtype=np.int64)
+
+    def histogram(self, descriptors):
+        return np.bincount(self.assign(descriptors),
+                           minlength=len(self.centers)).astype(np.float32)
+
+
+class RetrievalIndex:
+    def __init__(self, image_ids=None, vectors=None, idf=None):
+        self.image_ids = image_ids
+        self.vectors = vectors
+        self.idf = idf
+
+    def build(self, image_ids, histograms):
+        histograms = np.asarray(histograms, dtype=np.float32)
+        document_frequency = np.count_nonzero(histograms, axis=0)
+        self.idf = np.log(len(histograms) / np.maximum(document_frequency, 1),
+                          dtype=np.float32)
+        tf = histograms / np.maximum(histograms.sum(axis=1, keepdims=True), 1)
+        self.vectors = tf * self.idf
+        self.vectors /= np.maximum(
+            np.linalg.norm(self.vectors, axis=1, keepdims=True), 1e-12)
+        self.image_ids = list(image_ids)
+        return self
+
+    def query(self, k):
+        k = min(k, len(self.image_ids) - 1)
+        if k < 1:
+            return np.empty((len(self.image_ids), 0), dtype=np.int64)
+        similarity = self.vectors @ self.vectors.T
+        np.fill_diagonal(similarity, -np.inf)
+        neighbors = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(similarity, neighbors, axis=1),
+                           axis=1, kind='stable')
+        return np.take_along_axis(neighbors, order, axis=1)
+
+    def toData(self):
+        return self.image_ids, self.vectors, self.idf
@@ -0,0 +1,67 @@
+import cv2
+import json
+import numpy as np
+from ..colmap.read_write_model import rotmat2qvec
+
+
+# TwoViewGeometry::ConfigurationType values used by COLMAP.
+DEGENERATE = 1
+CALIBRATED = 2
+PLANAR_OR_PANORAMIC = 6
+
+
+class Verifier:
+    def __init__(self, K, threshold=4.0, confidence=0.999, min_inliers=15,
+                 max_h_inlier_ratio=0.8):
+        self.K = K
+        self.threshold = threshold
+        self.confidence = confidence
+        self.min_inliers = min_inliers
+        self.max_h_inlier_ratio = max_h_inlier_ratio
+        self.params = json.dumps({'threshold': threshold,
+                                  'confidence': confidence,
+                                  'min_inliers': min_inliers,
+                                  'max_h_inlier_ratio': max_h_inlier_ratio},
+                                 sort_keys=True)
+
+    def verify(self, points1, points2, seed=0):
+        geometry = {'config': DEGENERATE,
+                    'inliers': np.empty(0, dtype=np.int32),
+                    'F': np.eye(3), 'E': np.eye(3), 'H': np.eye(3),
+                    'qvec': np.array([1.0, 0.0, 0.0, 0.0]),
+                    'tvec': np.zeros(3)}
+        if len(points1) < max(self.min_inliers, 5):
+            return geometry
+        points1 = np.ascontiguousarray(points1, dtype=np.float64)
+        points2 = np.ascontiguousarray(points2, dtype=np.float64)
+        # RANSAC draws from the calling thread's RNG.
+        cv2.setRNGSeed(seed)
+        E, mask = cv2.findEssentialMat(points1, points2, self.K, cv2.RANSAC,
+                                       self.confidence, self.threshold)
+        if E is None or mask is None:
+            return geometry
+        E = E[:3]
+        e_inliers = np.flatnonzero(mask.ravel()).astype(np.int32)
+        if len(e_inliers) < self.min_inliers:
+            return geometry
+        H, mask = cv2.findHomography(points1, points2, cv2.RANSAC,
+                                     self.threshold,
+                                     confidence=self.confidence)
+        h_inliers = np.empty(0, dtype=np.int32) if mask is None else \
+            np.flatnonzero(mask.ravel()).astype(np.int32)
+        K_inv = np.linalg.inv(self.K)
+        geometry['E'] = E
+        geometry['F'] = K_inv.T @ E @ K_inv
+        if H is not None:
+            geometry['H'] = H
+        if len(h_inliers) / len(e_inliers) > self.max_h_inlier_ratio:
+            geometry['config'] = PLANAR_OR_PANORAMIC
+            geometry['inliers'] = h_inliers
+        else:
+            geometry['config'] = CALIBRATED
+            geometry['inliers'] = e_inliers
+            _, R, t, _ = cv2.recoverPose(E, points1[e_inliers],
+                                         points2[e_inliers], self.K)
+            geometry['qvec'] = rotmat2qvec(R)
+            geometry['tvec'] = t.ravel()
+        return geometry
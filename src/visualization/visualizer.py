@@ -13,7 +13,13 @@ class Visualizer:
         algorithms = []
         con = sqlite3.connect(self.analysis_database_path)
         cur = con.cursor()
-        cur.execute('SELECT sequence, detector_type, feature_type, points, error FROM reconstruction WHERE detector_type in ("SIFT","SURF","FAST") and feature_type in ("SIFT","SURF","DAISY");')
+        cur.execute('SELECT sequence, detector_type, feature_type, points, '
+                    'error FROM reconstruction '
+                    'WHERE detector_type in ("SIFT","SURF","FAST") '
+                    'and feature_type in ("SIFT","SURF","DAISY") '
+                    'and scale = 1 and compaction = "" and selection = "" '
+                    'and matcher = "" and tiling = "" and pairs = "" '
+                    'and verification = "colmap";')
         rows = cur.fetchall()
         for row in rows:
             if row[0] not in sequences: